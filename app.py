@@ -2,21 +2,42 @@
 # -*- coding: utf-8 -*-
 
 from gevent import monkey; monkey.patch_all()
+import gevent
 
 from bottle import Bottle, request, response, run, abort
 import bottle.ext.mongo
 import bottle.ext.redis
 import os
+import re
+import functools
+import gzip
+import mmap
+import StringIO
 from datetime import datetime
 
-from ghdata.config import MONGODB_URI, REDIS_HOST, REDIS_PORT, REDIS_DB
-from ghdata.db import format_key as _format
+from ghdata.config import MONGODB_URI, MONGODB_DB, REDIS_HOST, REDIS_PORT, REDIS_DB, REPO_CONTRIBUTORS_K
+from ghdata.db import format_key as _format, namespace
+from ghdata.sketch import SpaceSaving
+import ghdata.active as active
+import ghdata.snapshot as snapshot
+import ghdata.ids as ids
 import ghdata.tasks as tasks
 
 app = Bottle()
-app.install(bottle.ext.mongo.MongoPlugin(uri=MONGODB_URI, db="github", json_mongo=True))
+app.install(bottle.ext.mongo.MongoPlugin(uri=MONGODB_URI, db=MONGODB_DB, json_mongo=True))
 app.install(bottle.ext.redis.RedisPlugin(host=REDIS_HOST, port=REDIS_PORT, database=REDIS_DB))
 
+
+@app.install
+def namespaced(callback):
+    '''hand the handlers the mongo database of the active namespace.'''
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        if 'mongodb' in kwargs:
+            kwargs['mongodb'] = kwargs['mongodb'].connection[namespace()['db']]
+        return callback(*args, **kwargs)
+    return wrapper
+
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
@@ -28,6 +49,13 @@ cache_opts = {
 
 cache = CacheManager(**parse_cache_config_options(cache_opts))
 
+month_re = re.compile(r"^[0-9]{4}-[0-9]{2}$")
+# Longest month range a timeline request may cover.
+MAX_TIMELINE_MONTHS = 1200
+
+# manifest and memory-mapped files of the published snapshots.
+_snapshots = {'mtime': None, 'manifest': {}, 'files': {}}
+
 
 @app.hook("after_request")
 def crossDomianHook():
@@ -36,15 +64,29 @@ def crossDomianHook():
 
 @app.route(path="/languages", method="OPTIONS")
 @app.route(path="/rank", method="OPTIONS")
+@app.route(path="/timeline", method="OPTIONS")
+@app.route(path="/repos/rank", method="OPTIONS")
 def options1(method, *args):
     return options(*args)
 
 
 @app.route(path="/users/:id", method="OPTIONS")
+@app.route(path="/users/:id/related", method="OPTIONS")
 def options2(id, *args):
     return options(*args)
 
 
+@app.route(path="/active/:kind", method="OPTIONS")
+def options4(kind, *args):
+    return options(*args)
+
+
+@app.route(path="/repos/:owner/:name/contributors", method="OPTIONS")
+@app.route(path="/repos/:owner/:name/related", method="OPTIONS")
+def options3(owner, name, *args):
+    return options(*args)
+
+
 def options(*args):
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE"
     if request.headers.get("Access-Control-Request-Headers"):
@@ -59,32 +101,191 @@ def user(id, rdb, mongodb):
         return abort(404)
     user['rank'] = {}
     langs = [lang for lang in user.get('contrib', {})]
+    uid = ids.ids(rdb, [id], create=False)[0] or ''
     pipe = rdb.pipeline()
     if user.get('loc', {}).get('country') == 'China':
         for lang in langs:
             key = _format("country:{0}.lang:{1}:user".format(user.get('loc', {}).get('country', 'China'), lang))
-            pipe.zrevrank(key, id)
+            pipe.zrevrank(key, uid)
         user['rank']['China'] = {lang: rank + 1 for lang, rank in zip(langs, pipe.execute()) if rank is not None}
     user['loc_zh'] = {key: translate(text) for key, text in user.get('loc', {}).items() if key in ['country', 'state', 'city']}
     for lang in langs:
         key = _format("lang:{0}:user".format(lang))
-        pipe.zrevrank(key, id)
+        pipe.zrevrank(key, uid)
     user['rank']['World'] = {lang: rank + 1 for lang, rank in zip(langs, pipe.execute()) if rank is not None}
     return user
 
 
+@app.get("/users/:id/related")
+def related_users(id, mongodb):
+    related = mongodb.related_users.find_one({'_id': id.lower()})
+    if not related:
+        return abort(404)
+    return related
+
+
+@app.get("/repos/:owner/:name/related")
+def related_repos(owner, name, mongodb):
+    related = mongodb.related_repos.find_one({'_id': '%s/%s' % (owner, name)})
+    if not related:
+        return abort(404)
+    return related
+
+
+@app.get("/repos/:owner/:name/contributors")
+def contributors(owner, name, mongodb):
+    repo = mongodb.repositories.find_one({'_id': '%s/%s' % (owner, name)}, {'contributors': 1})
+    if not repo:
+        return abort(404)
+    count = int(request.query.count or 20)
+    sketch = SpaceSaving.from_doc(repo.get('contributors'), REPO_CONTRIBUTORS_K)
+    return {
+        'repo': repo['_id'],
+        'total': sketch.total,
+        # counts are over-estimated by at most this much.
+        'max_error': sketch.min_count(),
+        'data': [{'user': user, 'count': c, 'error': e, 'guaranteed': g}
+                 for user, c, e, g in sketch.guaranteed(count)]
+    }
+
+
+@app.get("/active/:kind")
+def active_users(kind, rdb):
+    '''distinct active users of languages or countries over a range of months.'''
+    if kind not in active.KINDS:
+        return abort(404)
+    now = datetime.now()
+    year, month = (now.year-1, 12) if now.month == 1 else (now.year, now.month-1)
+    start = request.query.get('from') or '%04d-%02d' % (year, month)
+    end = request.query.get('to') or start
+    if not (month_re.match(start) and month_re.match(end)):
+        return abort(400, 'from/to should be YYYY-MM.')
+    names = [n for n in (request.query.names or '').split(',') if n]
+    if not names:
+        return abort(400, 'names is required.')
+    k = active.KINDS[kind]
+    result = {'kind': kind, 'names': names, 'from': start, 'to': end,
+              'count': active.count(rdb, k, names, start, end)}
+    if request.query.by == 'month':
+        pipe = rdb.pipeline()
+        ms = list(active.months(start, end))
+        for m in ms:
+            active.pfcount(pipe, [active.key(k, name, m) for name in names])
+        result['months'] = dict(zip(ms, pipe.execute()))
+    return result
+
+
+@app.get("/timeline")
+def timeline(rdb):
+    '''activity histogram of all events or some event types.
+
+    granularity is month (YYYY-MM), day (weekday 0-6) or hour (0-23),
+    from/to select a range and points downsamples it by summing buckets.
+    '''
+    granularity = request.query.granularity or 'month'
+    if granularity not in ['month', 'day', 'hour']:
+        return abort(400, 'granularity should be month, day or hour.')
+    events = sorted(e for e in (request.query.event or '').split(',') if e)
+    total, series = _timeline(tuple(events), granularity, namespace()['prefix'], rdb)
+    start, end = request.query.get('from'), request.query.get('to')
+    if granularity == 'month':
+        if not all(month_re.match(m) for m in [start, end] if m):
+            return abort(400, 'from/to should be YYYY-MM.')
+        first, last = start or min(series or [None]), end or max(series or [None])
+        if first and last and _month_index(last) - _month_index(first) >= MAX_TIMELINE_MONTHS:
+            return abort(400, 'from/to should be at most %d months apart.' % MAX_TIMELINE_MONTHS)
+        labels = list(active.months(first, last)) if first and last else []
+    else:
+        size = 24 if granularity == 'hour' else 7
+        try:
+            first, last = max(int(start or 0), 0), min(int(end or size - 1), size - 1)
+        except ValueError:
+            return abort(400, 'from/to should be integers.')
+        labels = [str(i) for i in range(first, last + 1)]
+    data = [[label, series.get(label, 0)] for label in labels]
+    try:
+        points = int(request.query.points or 0)
+    except ValueError:
+        return abort(400, 'points should be an integer.')
+    if 0 < points < len(data):
+        step = -(-len(data) // points)
+        data = [[data[i][0], sum(v for l, v in data[i:i + step])] for i in range(0, len(data), step)]
+    return {
+        'event': events,
+        'granularity': granularity,
+        'total': total,
+        'data': data
+    }
+
+
+def _month_index(ym):
+    year, month = map(int, ym.split('-'))
+    return year * 12 + month
+
+
+@cache.cache("timeline", type="memory", expire=60)
+def _timeline(events, granularity, prefix, rdb):
+    pipe = rdb.pipeline()
+    if events:
+        for evttype in events:
+            pipe.zscore(_format("event"), evttype)
+            pipe.hgetall(_format("event:{0}:{1}".format(evttype, granularity)))
+    else:
+        pipe.get(_format("total"))
+        pipe.hgetall(_format(granularity))
+    results = pipe.execute()
+    total, series = 0, {}
+    for count, hist in zip(results[::2], results[1::2]):
+        total += int(float(count or 0))
+        for label, value in hist.items():
+            series[label] = series.get(label, 0) + int(value)
+    return total, series
+
+
 @cache.cache("rank")
 def translate(text):
     return tasks.translate(text)
 
 
+def _snapshot(key):
+    '''serve a pre-rendered page if the last publishing produced it.'''
+    path = snapshot.directory()
+    try:
+        mtime = (path, os.stat(os.path.join(path, snapshot.MANIFEST)).st_mtime)
+    except OSError:
+        return None
+    if mtime != _snapshots['mtime']:
+        for m in _snapshots['files'].values():
+            m.close()
+        _snapshots.update(mtime=mtime, manifest=snapshot.read_manifest(path), files={})
+    if key not in _snapshots['manifest']:
+        return None
+    fn, etag = _snapshots['manifest'][key]
+    if fn not in _snapshots['files']:
+        try:
+            with open(os.path.join(path, fn), 'rb') as f:
+                _snapshots['files'][fn] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError):
+            return None
+    response.set_header('ETag', '"%s"' % etag)
+    response.set_header('Vary', 'Accept-Encoding')
+    response.content_type = 'application/json'
+    if etag in request.headers.get('If-None-Match', ''):
+        response.status = 304
+        return ''
+    content = _snapshots['files'][fn][:]
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_header('Content-Encoding', 'gzip')
+        return content
+    return gzip.GzipFile(fileobj=StringIO.StringIO(content)).read()
+
+
 @app.get("/languages")
 def languages(mongodb):
-    now = datetime.now()
-    year, month = (now.year-1, 12) if now.month == 1 else (now.year, now.month-1)
-    key = 'month.%d.%2d' % (year, month)
-    # get languages sorted by activity of last month in the world.
-    return {'data': [lang['_id'] for lang in mongodb.languages.find().sort(key, -1).limit(20)]}
+    content = _snapshot(snapshot.manifest_key())
+    if content is not None:
+        return content
+    return {'data': snapshot.top_languages(mongodb)}
 
 
 @app.get("/rank")
@@ -92,34 +293,65 @@ def rank(rdb, mongodb):
     country = request.query.country or 'China'
     lang = request.query.language or 'JavaScript'
     page = int(request.query.page or 0)
-    page_count = int(request.query.page_count or 50)
+    page_count = int(request.query.page_count or snapshot.PAGE_COUNT)
+    if page_count == snapshot.PAGE_COUNT:
+        content = _snapshot(snapshot.manifest_key(country, lang, page))
+        if content is not None:
+            return content
     return _rank(lang, country, page, page_count, rdb, mongodb)
 
 
 @cache.cache("rank", expire=3600)
 def _rank(lang, country, page, page_count, rdb, mongodb):
-    key = _format("country:{0}.lang:{1}:user".format(country, lang))
+    return snapshot.rank_page(lang, country, page, page_count, rdb, mongodb)
+
+
+@app.get("/repos/rank")
+def repos_rank(rdb, mongodb):
+    lang = request.query.language
+    month = request.query.month
+    if month and not month_re.match(month):
+        return abort(400, 'month should be YYYY-MM.')
+    if lang and month:
+        # there are no monthly leaderboards per language.
+        return abort(400, 'language and month can not be combined.')
+    page = int(request.query.page or 0)
+    page_count = int(request.query.page_count or 50)
+    return _repos_rank(lang, month, page, page_count, namespace()['prefix'], rdb, mongodb)
+
+
+@cache.cache("rank", expire=600)
+def _repos_rank(lang, month, page, page_count, prefix, rdb, mongodb):
+    if lang:
+        key = _format("lang:{0}:repo".format(lang))
+    elif month:
+        key = _format("month:{0}:repo".format(month))
+    else:
+        key = _format("repo")
     total = rdb.zcard(key)
     pages = total/page_count + (total % page_count and 1)
-    users = rdb.zrevrange(key, page*page_count, (page+1)*page_count - 1)
-    w_key = _format("lang:{0}:user".format(lang))
-    pipe = rdb.pipeline()
-    for u in users:
-        pipe.zrevrank(w_key, u)
-    w_ranks = pipe.execute()
-    data = [mongodb.users_stats.find_one({'_id': u}, {'info': 1, 'contrib': 1}) for u in users]
-    for i, (user, wr) in enumerate(zip(data, w_ranks)):
-        user['rank'] = {country: page_count*page + i + 1, 'world': wr + 1}
+    repos = rdb.zrevrange(key, page*page_count, (page+1)*page_count - 1, withscores=True)
+    fields = ['info.description', 'info.language', 'info.html_url', 'info.stargazers_count', 'total']
+    found = {r['_id']: r for r in mongodb.repositories.find({'_id': {'$in': [name for name, score in repos]}},
+                                                           dict((f, 1) for f in fields))}
+    data = []
+    for i, (name, score) in enumerate(repos):
+        repo = found.get(name, {'_id': name})
+        repo['rank'] = page_count*page + i + 1
+        repo['score'] = int(score)
+        data.append(repo)
     return {
         'pages': pages,
         'page': page,
         'page_count': page_count,
         'language': lang,
-        'country': country,
+        'month': month,
         'data': data
     }
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    # in a greenlet: builds block their connection, and redis may be down at startup.
+    gevent.spawn(tasks.ensure_indexes)
     run(app=app, server="gevent", host="0.0.0.0", port=port)
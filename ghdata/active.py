@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Distinct active users per month, kept as redis HyperLogLogs.
+
+Keys are "active:<kind>:<name>:<YYYY-MM>" with kind "lang" or "country",
+full year rollups are "active:<kind>:<name>:<YYYY>".
+'''
+
+from datetime import datetime
+
+from .db import format_key as _format
+
+__all__ = ["KINDS", "key", "months", "add", "add_user_months", "pfcount", "count", "rollup"]
+
+KINDS = {'languages': 'lang', 'countries': 'country'}
+
+
+def key(kind, name, period):
+    return _format('active:{0}:{1}:{2}'.format(kind, name, period))
+
+
+def months(start, end):
+    '''"YYYY-MM" strings from start to end inclusive.'''
+    year, month = map(int, start.split('-'))
+    end_year, end_month = map(int, end.split('-'))
+    while (year, month) <= (end_year, end_month):
+        yield '%04d-%02d' % (year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def add(pipe, kind, name, year_month, users):
+    users = list(users)
+    if users:
+        pipe.pfadd(key(kind, name, year_month), *users)
+
+
+def add_user_months(pipe, country, username, user_months):
+    '''register a user in the country counters of every month it was active.
+
+    user_months is the "month" field of a users_stats document.
+    '''
+    for year in user_months or {}:
+        for month in user_months[year]:
+            add(pipe, 'country', country, '%s-%s' % (year, month), [username])
+
+
+def _range_keys(r, kind, name, start, end):
+    '''keys covering the range, using yearly rollups for whole past years.'''
+    this_year = datetime.now().year
+    keys, ms = [], list(months(start, end))
+    while ms:
+        year = ms[0][:4]
+        in_year = [m for m in ms if m[:4] == year]
+        ms = ms[len(in_year):]
+        if len(in_year) == 12 and int(year) < this_year and r.exists(key(kind, name, year)):
+            keys.append(key(kind, name, year))
+        else:
+            keys.extend(key(kind, name, m) for m in in_year)
+    return keys
+
+
+def pfcount(r, keys):
+    '''PFCOUNT of the union of keys, r may be a pipeline.
+
+    redis-py 2.10 pfcount() takes a single key.
+    '''
+    return r.execute_command('PFCOUNT', *keys)
+
+
+def count(r, kind, names, start, end):
+    '''estimated number of distinct users active in any of names between start and end.'''
+    keys = [k for name in names for k in _range_keys(r, kind, name, start, end)]
+    return pfcount(r, keys) if keys else 0
+
+
+def rollup(r, kind, name, year):
+    '''merge the monthly counters of a year into the yearly one.'''
+    ms = ['%04d-%02d' % (year, m) for m in range(1, 13)]
+    r.pfmerge(key(kind, name, year), *[key(kind, name, m) for m in ms])
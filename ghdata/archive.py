@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Local store of the GitHub Archive hourly files.
+
+Hours are identified by "YYYY-MM-DD-H" keys. Every stored hour is recorded
+in a sqlite index with its container file, offset, size, sha1 and validity.
+New hours are written as loose "<key>.json.gz" files, pack() moves them
+into daily or monthly "<period>.pack" containers (gzip members appended one
+after another, so each hour stays randomly accessible), and evict() drops
+processed hours to keep the store under a size limit. reindex() picks up
+loose files written before the index existed.
+'''
+
+import os
+import re
+import time
+import gzip
+import zlib
+import struct
+import sqlite3
+import hashlib
+import StringIO
+from contextlib import closing
+from datetime import datetime
+
+from .config import ARCHIVE_DIR
+
+__all__ = ["hour_key", "parse", "exists", "put", "reindex", "open_hour", "verify", "pack", "evict"]
+
+key_re = re.compile(r"^([0-9]{4})-([0-9]{2})-([0-9]{2})-([0-9]+)$")
+INDEX = 'index.sqlite'
+
+
+def hour_key(year, month, day, hour):
+    return "{year}-{month:02d}-{day:02d}-{hour}".format(year=year, month=month, day=day, hour=hour)
+
+
+def parse(key):
+    '''(year, month, day, hour) of a key.'''
+    return tuple(map(int, key_re.findall(key)[0]))
+
+
+def _index(path=ARCHIVE_DIR):
+    os.path.exists(path) or os.makedirs(path)
+    conn = sqlite3.connect(os.path.join(path, INDEX), timeout=120)
+    conn.execute('''CREATE TABLE IF NOT EXISTS hours (
+                        hour TEXT PRIMARY KEY,
+                        container TEXT NOT NULL,
+                        offset INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        sha1 TEXT NOT NULL,
+                        valid INTEGER NOT NULL,
+                        checked REAL NOT NULL)''')
+    return conn
+
+
+def _valid(content):
+    '''a complete gzip stream, CRC and length checked.'''
+    try:
+        with gzip.GzipFile(fileobj=StringIO.StringIO(content)) as f:
+            while f.read(1 << 20):
+                pass
+        return True
+    except (IOError, EOFError, zlib.error, struct.error):
+        return False
+
+
+def _read(row, path=ARCHIVE_DIR):
+    container, offset, size = row
+    with open(os.path.join(path, container), 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _record(conn, key, fn, content):
+    conn.execute('INSERT OR REPLACE INTO hours VALUES (?, ?, 0, ?, ?, 1, ?)',
+                 (key, fn, len(content), hashlib.sha1(content).hexdigest(), time.time()))
+
+
+def put(key, content, path=ARCHIVE_DIR):
+    '''store a downloaded hour, return False if it is not a valid gzip file.'''
+    if not _valid(content):
+        return False
+    os.path.exists(path) or os.makedirs(path)
+    fn = '%s.json.gz' % key
+    tmp = os.path.join(path, '.%s.tmp' % fn)
+    with open(tmp, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, os.path.join(path, fn))
+    with closing(_index(path)) as conn, conn:
+        _record(conn, key, fn, content)
+    return True
+
+
+def reindex(path=ARCHIVE_DIR):
+    '''index the loose hour files missing from the index, return their number.
+
+    Files stored before the index existed are only found this way, corrupt
+    ones are removed.
+    '''
+    with closing(_index(path)) as conn:
+        indexed = set(row[0] for row in conn.execute('SELECT hour FROM hours'))
+    added = 0
+    for fn in sorted(os.listdir(path)):
+        key = fn[:-len('.json.gz')]
+        if not fn.endswith('.json.gz') or not key_re.match(key) or key in indexed:
+            continue
+        with open(os.path.join(path, fn), 'rb') as f:
+            content = f.read()
+        if not _valid(content):
+            print("Removing corrupt archive %s." % fn)
+            os.remove(os.path.join(path, fn))
+            continue
+        with closing(_index(path)) as conn, conn:
+            _record(conn, key, fn, content)
+        added += 1
+    return added
+
+
+def exists(key, path=ARCHIVE_DIR):
+    '''whether a valid copy of the hour is stored.
+
+    Loose files written before the index existed are checked and indexed,
+    invalid entries are dropped so the hour gets fetched again.
+    '''
+    with closing(_index(path)) as conn:
+        row = conn.execute('SELECT valid FROM hours WHERE hour = ?', (key,)).fetchone()
+    if row is not None:
+        if row[0]:
+            return True
+        _drop(key, path)
+        return False
+    fn = os.path.join(path, '%s.json.gz' % key)
+    if os.path.exists(fn):
+        with open(fn, 'rb') as f:
+            if put(key, f.read(), path):
+                return True
+        print("Removing corrupt archive %s." % fn)
+        os.remove(fn)
+    return False
+
+
+def _drop(key, path=ARCHIVE_DIR):
+    with closing(_index(path)) as conn, conn:
+        row = conn.execute('SELECT container FROM hours WHERE hour = ?', (key,)).fetchone()
+        conn.execute('DELETE FROM hours WHERE hour = ?', (key,))
+    # packed bytes stay in the container until the whole container is evicted.
+    if row and not row[0].endswith('.pack') and os.path.exists(os.path.join(path, row[0])):
+        os.remove(os.path.join(path, row[0]))
+
+
+def open_hour(key, path=ARCHIVE_DIR, retries=2):
+    '''file object over the decompressed content of an hour, None if not stored.'''
+    for attempt in range(retries + 1):
+        with closing(_index(path)) as conn:
+            row = conn.execute('SELECT container, offset, size FROM hours WHERE hour = ? AND valid = 1',
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return gzip.GzipFile(fileobj=StringIO.StringIO(_read(row, path)))
+        except IOError:
+            # pack() may have moved the hour since the lookup, look it up again.
+            if attempt == retries:
+                raise
+
+
+def verify(path=ARCHIVE_DIR):
+    '''check every valid hour against its checksum, return the keys found corrupt.'''
+    with closing(_index(path)) as conn:
+        rows = conn.execute('SELECT hour, container, offset, size, sha1 FROM hours WHERE valid = 1').fetchall()
+    corrupt = []
+    for key, container, offset, size, sha1 in rows:
+        try:
+            content = _read((container, offset, size), path)
+            ok = len(content) == size and hashlib.sha1(content).hexdigest() == sha1
+        except IOError:
+            ok = False
+        if not ok:
+            corrupt.append(key)
+    with closing(_index(path)) as conn, conn:
+        now = time.time()
+        conn.executemany('UPDATE hours SET valid = 0, checked = ? WHERE hour = ?',
+                         [(now, key) for key in corrupt])
+        conn.execute('UPDATE hours SET checked = ? WHERE valid = 1', (now,))
+    return corrupt
+
+
+def pack(period='day', path=ARCHIVE_DIR):
+    '''move the loose hours of finished days (or months) into containers.'''
+    width = 10 if period == 'day' else 7
+    current = datetime.utcnow().strftime('%Y-%m-%d')[:width]
+    with closing(_index(path)) as conn:
+        rows = conn.execute("SELECT hour, container, size FROM hours "
+                            "WHERE valid = 1 AND container NOT LIKE '%.pack' ORDER BY hour").fetchall()
+    packed = 0
+    for key, container, size in rows:
+        name = key[:width]
+        if name >= current:
+            continue
+        pack_fn = '%s.pack' % name
+        with open(os.path.join(path, container), 'rb') as f:
+            content = f.read()
+        with open(os.path.join(path, pack_fn), 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        with closing(_index(path)) as conn, conn:
+            conn.execute('UPDATE hours SET container = ?, offset = ? WHERE hour = ?', (pack_fn, offset, key))
+        os.remove(os.path.join(path, container))
+        packed += 1
+    return packed
+
+
+def evict(max_bytes, processed, path=ARCHIVE_DIR):
+    '''remove the oldest processed hours until the store fits in max_bytes.
+
+    processed(key) tells whether an hour is no longer needed. A container is
+    only removed once all of its hours are processed.
+    '''
+    with closing(_index(path)) as conn:
+        rows = conn.execute('SELECT hour, container, size FROM hours ORDER BY hour').fetchall()
+    containers = {}
+    for key, container, size in rows:
+        keys, total = containers.get(container, ([], 0))
+        containers[container] = (keys + [key], total + size)
+    used = sum(total for keys, total in containers.values())
+    evicted = 0
+    for container in sorted(containers, key=lambda c: containers[c][0][0]):
+        if used <= max_bytes:
+            break
+        keys, total = containers[container]
+        if not all(processed(key) for key in keys):
+            continue
+        with closing(_index(path)) as conn, conn:
+            conn.executemany('DELETE FROM hours WHERE hour = ?', [(key,) for key in keys])
+        fn = os.path.join(path, container)
+        os.path.exists(fn) and os.remove(fn)
+        used -= total
+        evicted += len(keys)
+    return evicted
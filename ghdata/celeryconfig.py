@@ -38,6 +38,27 @@ CELERYBEAT_SCHEDULE = {
     'rank': {
         'task': 'ghdata.tasks.rank',
         'schedule': crontab(hour=0, minute=0)
+    },
+    'maintain-archive': {
+        'task': 'ghdata.tasks.maintain_archive',
+        'schedule': crontab(hour=6, minute=0)
+    },
+    'verify-archive': {
+        'task': 'ghdata.tasks.verify_archive',
+        'schedule': crontab(hour=6, minute=30, day_of_week='saturday')
+    },
+    'related': {
+        'task': 'ghdata.tasks.related',
+        'schedule': crontab(minute=0, hour=3, day_of_week='monday')
+    },
+    'rollup-active-users': {
+        'task': 'ghdata.tasks.rollup_active_users',
+        'schedule': crontab(hour=2, minute=0, day_of_month=1)
+    },
+    # backfilled hours may add repositories to closed months again.
+    'trim-month-repo-ranks': {
+        'task': 'ghdata.tasks.trim_month_repo_ranks',
+        'schedule': crontab(hour=4, minute=0)
     }
 }
 
@@ -56,12 +77,28 @@ CELERY_ROUTES = {
     'ghdata.tasks.update_repos': {'queue': 'github'},
     'ghdata.tasks.update_location': {'queue': 'geo'},
     'ghdata.tasks.fetch_worker': {'queue': 'fetch'},
+    'ghdata.tasks.fetch_range': {'queue': 'fetch'},
+    'ghdata.tasks.verify_archive': {'queue': 'fetch'},
+    'ghdata.tasks.maintain_archive': {'queue': 'fetch'},
     'ghdata.tasks.country_rank': {'queue': 'stats'},
     'ghdata.tasks.city_rank': {'queue': 'stats'},
     'ghdata.tasks.user_rank': {'queue': 'stats'},
+    'ghdata.tasks.publish_rank': {'queue': 'stats'},
+    'ghdata.tasks.related': {'queue': 'stats'},
+    'ghdata.tasks.ensure_indexes': {'queue': 'stats'},
     'ghdata.tasks.update_users_location': {'queue': 'stats'},
     'ghdata.tasks.rank': {'queue': 'stats'},
+    'ghdata.tasks.migrate_repo_contributors': {'queue': 'stats'},
+    'ghdata.tasks.rollup_active_users': {'queue': 'stats'},
+    'ghdata.tasks.trim_month_repo_ranks': {'queue': 'stats'},
+    'ghdata.tasks.migrate_event_month_keys': {'queue': 'stats'},
+    'ghdata.tasks.migrate_user_ids': {'queue': 'stats'},
+    'ghdata.tasks.migrate_repo_rank': {'queue': 'stats'},
     'ghdata.tasks.translate': {'queue': 'stats'},
     'ghdata.tasks.update_all_users': {'queue': 'celery'},
-    'ghdata.tasks.fetch_timeline': {'queue': 'celery'}
+    'ghdata.tasks.fetch_timeline': {'queue': 'celery'},
+    'ghdata.tasks.dispatch_hours': {'queue': 'celery'},
+    'ghdata.tasks.recompute': {'queue': 'celery'},
+    'ghdata.tasks.finish_recompute': {'queue': 'stats'},
+    'ghdata.tasks.gc_namespace': {'queue': 'stats'}
 }
@@ -4,15 +4,48 @@
 import os
 from urlparse import urlparse
 
-__all__ = ["MONGODB_URI", "REDIS_URI", "REDIS_HOST", "REDIS_PORT", "REDIS_DB", "GITHUB_CRENDENTIALS"]
+__all__ = ["MONGODB_URI", "REDIS_URI", "REDIS_HOST", "REDIS_PORT", "REDIS_DB", "GITHUB_CRENDENTIALS",
+           "MONGODB_DB", "NAMESPACE_TTL", "NAMESPACE_GC_DELAY", "RECOMPUTE_TTL", "REPO_CONTRIBUTORS_K", "MONTH_REPO_RANK_SIZE",
+           "SNAPSHOT_DIR", "POOL_SIZE", "POOL_SIZES",
+           "ARCHIVE_DIR", "ARCHIVE_PACK", "ARCHIVE_MAX_BYTES",
+           "FETCH_BATCH_HOURS", "FETCH_MAX_PENDING", "FETCH_DISPATCH_DELAY"]
 
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+# Database of the default namespace, and how long processes cache the active one.
+MONGODB_DB = os.getenv("MONGODB_DB", "github")
+NAMESPACE_TTL = int(os.getenv("NAMESPACE_TTL", 5))
+# Seconds to keep a replaced namespace around for requests still using it.
+NAMESPACE_GC_DELAY = int(os.getenv("NAMESPACE_GC_DELAY", 3600))
+# Seconds a recompute may run before another one is allowed to start.
+RECOMPUTE_TTL = int(os.getenv("RECOMPUTE_TTL", 3600 * 24 * 14))
 REDIS_URI = os.getenv("REDIS_URI", "redis://localhost:6379/1")
 GITHUB_CRENDENTIALS = os.environ.get(
     "GITHUB_CRENDENTIALS",
     "02d0253edfa0f44fdfee:5f759bdc51b1a043ec90d2aaea0cedae1dea3bd2"
 )
+# Counters kept per repository in the top contributors sketch.
+REPO_CONTRIBUTORS_K = int(os.getenv("REPO_CONTRIBUTORS_K", 100))
+# Repositories kept in the leaderboard of a closed month.
+MONTH_REPO_RANK_SIZE = int(os.getenv("MONTH_REPO_RANK_SIZE", 1000))
+# Where the pre-rendered ranking pages are published.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/tmp/ghdata/snapshots")
+# Redis/Mongo connection pool size per process, by the queue a worker consumes.
+POOL_SIZE = int(os.getenv("POOL_SIZE", 10))
+POOL_SIZES = {
+    queue: int(os.getenv("POOL_SIZE_%s" % queue.upper(), size))
+    for queue, size in [('github', 4), ('geo', 4), ('fetch', 8), ('stats', 16), ('celery', 4)]
+}
+# Local GitHub Archive store: packing period ("day", "month" or "" for none)
+# and size limit in bytes (0 for unlimited) before processed hours are evicted.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./data")
+ARCHIVE_PACK = os.getenv("ARCHIVE_PACK", "day")
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", 0))
+# Hours processed by one fetch task, most tasks waiting in the fetch queue,
+# and seconds before dispatching more when the queue is full.
+FETCH_BATCH_HOURS = int(os.getenv("FETCH_BATCH_HOURS", 24))
+FETCH_MAX_PENDING = int(os.getenv("FETCH_MAX_PENDING", 20))
+FETCH_DISPATCH_DELAY = int(os.getenv("FETCH_DISPATCH_DELAY", 60))
 
 ru = urlparse(REDIS_URI)
 REDIS_HOST = ru.hostname
@@ -3,25 +3,102 @@
 
 import redis as _redis
 import os
-from pymongo import MongoClient
+import json
+import time
+import threading
+from contextlib import contextmanager
 
 from .config import *
 
-pool = _redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
-mongo_client = MongoClient(MONGODB_URI)
+# Connections are created on first use in each process, a forked child
+# never reuses the sockets of its parent.
+_conns = {'pid': None, 'pool': None, 'mongo': None, 'size': POOL_SIZE}
+
+
+def configure(pool_size):
+    '''set the size of the connection pools of this process.'''
+    _conns['size'] = pool_size
+    reset()
+
+
+def reset():
+    '''drop the connections, they are created again on next use.'''
+    if _conns['pid'] == os.getpid():
+        if _conns['pool'] is not None:
+            _conns['pool'].disconnect()
+        if _conns['mongo'] is not None:
+            _conns['mongo'].close()
+    _conns.update(pid=None, pool=None, mongo=None)
+
+
+def _connections():
+    if _conns['pid'] != os.getpid():
+        from pymongo import MongoClient
+        _conns.update(
+            pid=os.getpid(),
+            pool=_redis.BlockingConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+                                               max_connections=_conns['size']),
+            mongo=MongoClient(MONGODB_URI, max_pool_size=_conns['size'])
+        )
+    return _conns
 
 
 def redis():
-    return _redis.Redis(connection_pool=pool)
+    return _redis.Redis(connection_pool=_connections()['pool'])
 
 
 def pipe():
     return redis().pipeline()
 
 
+# A namespace is the redis key prefix and the mongo database holding the
+# aggregated data. The active one is stored in redis, a recompute works in a
+# shadow namespace set for the current thread with use_namespace().
+_local = threading.local()
+_active = {'ns': None, 'expires': 0}
+
+
+def default_namespace():
+    return {'prefix': os.environ.get('PREFIX', 'gtl'), 'db': MONGODB_DB}
+
+
+def control_key(name):
+    '''keys outside of any namespace.'''
+    return "%s:namespace:%s" % (os.environ.get('PREFIX', 'gtl'), name)
+
+
+def namespace():
+    ns = getattr(_local, 'ns', None)
+    if ns:
+        return ns
+    if _active['expires'] < time.time():
+        value = redis().get(control_key('active'))
+        _active.update(ns=json.loads(value) if value else default_namespace(),
+                       expires=time.time() + NAMESPACE_TTL)
+    return _active['ns']
+
+
+def set_namespace(ns):
+    '''atomically make ns the active namespace, return the previous one.'''
+    value = redis().getset(control_key('active'), json.dumps(ns))
+    _active['expires'] = 0
+    return json.loads(value) if value else default_namespace()
+
+
+@contextmanager
+def use_namespace(ns):
+    '''work in ns (None for the active one) in the current thread.'''
+    previous = getattr(_local, 'ns', None)
+    _local.ns = ns
+    try:
+        yield
+    finally:
+        _local.ns = previous
+
+
 def format_key(key):
-    return "%s:%s" % (os.environ.get('PREFIX', 'gtl'), key)
+    return "%s:%s" % (namespace()['prefix'], key)
 
 
 def mongodb():
-    return mongo_client.github
+    return _connections()['mongo'][namespace()['db']]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Timeline event decoding.
+
+Processors declare the fields they read with @projection, file_process then
+decodes every line once for all of them, and drops the raw lines which can
+not be a User event before decoding them. Events kept in memory for several
+processors are trimmed to the projected fields. ujson is used as the JSON
+backend when it is installed.
+'''
+
+try:
+    import ujson as _json
+except ImportError:
+    import json as _json
+
+__all__ = ["projection", "fields_of", "decode"]
+
+
+def projection(*fields, **options):
+    '''declare the dotted fields a processor reads.
+
+    users_only=True tells the processor skips every event whose actor is
+    not a User, so those lines may be dropped before decoding.
+    '''
+    def wrapper(fn):
+        fn.fields = fields
+        fn.users_only = options.get('users_only', False)
+        return fn
+    return wrapper
+
+
+def fields_of(fns):
+    '''(fields, users_only) satisfying all of fns, fields is None for everything.'''
+    fields = set()
+    for fn in fns:
+        if getattr(fn, 'fields', None) is None:
+            fields = None
+            break
+        fields.update(fn.fields)
+    return fields, all(getattr(fn, 'users_only', False) for fn in fns)
+
+
+def _project(obj, fields):
+    result = {}
+    for field in fields:
+        src, dst = obj, result
+        path = field.split('.')
+        for name in path[:-1]:
+            src = src.get(name)
+            if not isinstance(src, dict):
+                break
+            dst = dst.setdefault(name, {})
+        else:
+            if path[-1] in src:
+                dst[path[-1]] = src[path[-1]]
+    return result
+
+
+def decode(lines, fields=None, users_only=False):
+    '''events of utf-8 encoded lines.'''
+    for line in lines:
+        # Cheap pre-filter on the raw bytes: a User event has the "User" token.
+        if users_only and '"User"' not in line:
+            continue
+        try:
+            event = _json.loads(line.decode('utf-8', 'ignore'))
+        except Exception as e:
+            print "Error during load json: %s" % e
+            continue
+        yield _project(event, fields) if fields else event
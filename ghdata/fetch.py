@@ -1,50 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
-import os.path
 import re
-import json
-import requests
-import shutil
-import gzip
-from tempfile import NamedTemporaryFile
-import StringIO
+import time
+import random
 from datetime import date
 from collections import defaultdict
 
+from .config import REPO_CONTRIBUTORS_K
 from .db import redis, mongodb, pipe as _pipe, format_key as _format
+from .sketch import SpaceSaving
+from . import active
+from . import decoder
+from . import ids
+from . import archive
 
 # The URL template for the GitHub Archive.
 archive_url = ("http://data.githubarchive.org/"
                "{year}-{month:02d}-{day:02d}-{hour}.json.gz")
-local_url = "./data/{year}-{month:02d}-{day:02d}-{hour}.json.gz"
-date_re = re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2})-([0-9]+)\.json.gz")
-
-# mkdir data directory
-os.path.exists('./data') or os.mkdir('./data')
+# The event fields read by the processors below.
+event_fields = ('actor', 'actor_attributes.type', 'type', 'repository.owner',
+                'repository.name', 'repository.organization', 'repository.language')
 
 
 def fetch_one(year, month, day, hour):
-    '''Fecch one archived timeline.'''
-    local_fn = local_url.format(year=year, month=month, day=day, hour=hour)
-    if os.path.exists(local_fn):
-        print '%s exists.' % local_fn
-        return local_fn
+    '''Fecch one archived timeline, return its archive key.'''
+    key = archive.hour_key(year, month, day, hour)
+    if archive.exists(key):
+        print '%s exists.' % key
+        return key
     else:
+        import requests
         url = archive_url.format(year=year, month=month, day=day, hour=hour)
         r = None
         try:
             r = requests.get(url, timeout=120)
             if r.status_code == 200:
-                f = NamedTemporaryFile("wb", delete=False)
-                f.write(r.content)
-                f.flush()
-                os.fsync(f.fileno())
-                f.close()
-                shutil.move(f.name, local_fn)
-                print("Fetching %s successded." % url)
-                return local_fn
+                if archive.put(key, r.content):
+                    print("Fetching %s successded." % url)
+                    return key
+                print("Fetching %s got a corrupt file." % url)
             else:
                 print("Fetching %s failed." % url)
         except:
@@ -55,187 +50,338 @@ def fetch_one(year, month, day, hour):
     return None
 
 
-def _gen_json(buf):
-    line = buf.readline()
-    while line:
-        try:
-            yield json.loads(line)
-        except Exception as e:
-            print "Error during load json: %s" % e
-        line = buf.readline()
+def processed(key, fns, r=None):
+    '''whether all of fns already processed the hour.'''
+    r = r or redis()
+    return all(r.sismember(_format('function:%s' % fn.__name__), key) for fn in fns)
 
 
-def file_process(filename, fns):
-    if not filename or not os.path.exists(filename):
-        return
+def _clean(lines):
+    return all(l[:1] == '{' and l[-1:] == '}' and '}{"' not in l for l in lines)
+
+
+def _read_events(key, fields, users_only):
+    f = archive.open_hour(key)
+    if f is None:
+        print("%s is not in the archive." % key)
+        return None
+    with f:
+        content = f.read()
+    lines = content.splitlines()
+    if not _clean(lines):
+        # Events broken over several lines or glued together, repair the bytes.
+        content = re.sub(r"[^}](?:[\n\r]|\xe2\x80[\xa8\xa9])+[^{]", '', content)
+        lines = '}\n{"'.join(content.split('}{"')).splitlines()
+    del content
+    return decoder.decode(lines, fields, users_only)
+
+
+def file_process(key, fns):
+    if key:
+        hours_process([key], fns)
+
+
+def unprocessed(keys, fns, r=None):
+    '''{fn: [hours fn has not processed yet]}, checked in one round trip.'''
+    r = r or redis()
+    pipe = r.pipeline()
+    for key in keys:
+        for fn in fns:
+            pipe.sismember(_format('function:%s' % fn.__name__), key)
+    done = iter(pipe.execute())
+    pending = defaultdict(list)
+    for key in keys:
+        for fn in fns:
+            next(done) or pending[fn].append(key)
+    return pending
+
+
+def hours_process(keys, fns, pending=None):
+    '''run fns over several hours, sharing one aggregator per fn.
+
+    Results are written once at the end, and an hour is marked as processed
+    by a fn only after that fn's results are written. pending is the result
+    of unprocessed() if the caller already checked the hours.
+    '''
     fns = fns if type(fns) is list else [fns]
-    year, month, day, hour = map(int, date_re.findall(filename)[0])
     r = redis()
-    repl = lambda m: ''
-    for fn in fns:
-        print('Processing %s with %s' % (filename, fn.__name__))
-        fn_key = _format('function:%s' % fn.__name__)
-        fn_value = "{year}-{month:02d}-{day:02d}-{hour}".format(
-            year=year, month=month, day=day, hour=hour
-        )
-        if not r.sismember(fn_key, fn_value):
-            with gzip.GzipFile(filename) as f:
-                content = f.read().decode("utf-8", errors="ignore")
-                content = re.sub(u"[^\\}]([\\n\\r\u2028\u2029]+)[^\\{]", repl, content)
-                content = '}\n{"'.join(content.split('}{"'))
-                buf = StringIO.StringIO(content)
-                fn(_gen_json(buf), year, month, day, hour)
-            r.sadd(fn_key, fn_value)
+    if pending is None:
+        pending = unprocessed(keys, fns, r)
+    else:
+        keys = set(keys)
+        pending = dict((fn, [k for k in pending.get(fn, []) if k in keys]) for fn in fns)
+        pending = dict((fn, ks) for fn, ks in pending.items() if ks)
+    if not pending:
+        return
+    aggregators = dict((fn, fn.aggregator()) for fn in pending)
+    for key in sorted(set(k for ks in pending.values() for k in ks)):
+        hour_fns = [fn for fn in pending if key in pending[fn]]
+        # Decode once for all pending processors. Events shared by several of
+        # them are kept in memory, so only the fields they read are kept.
+        fields, users_only = decoder.fields_of(hour_fns)
+        try:
+            events = _read_events(key, fields if len(hour_fns) > 1 else None, users_only)
+        except Exception as e:
+            # a corrupt hour is left unmarked, the rest of the hours still count.
+            print("Error during reading %s: %s" % (key, e))
+            events = None
+        if events is None:
+            for fn in hour_fns:
+                pending[fn].remove(key)
+            continue
+        if len(hour_fns) > 1:
+            events = list(events)
+        year, month, day, hour = archive.parse(key)
+        for fn in hour_fns:
+            print('Processing %s with %s' % (key, fn.__name__))
+            aggregators[fn].process(iter(events), year, month, day, hour)
+    for fn, aggregator in aggregators.items():
+        aggregator.flush()
+        pending[fn] and r.sadd(_format('function:%s' % fn.__name__), *pending[fn])
 
 
 def _mongo_default():
     return defaultdict(lambda: defaultdict(int))
 
 
+class EventsAggregator(object):
+    '''Statistics of the events of one or more hours.'''
+
+    def __init__(self):
+        self.total = 0
+        # redis hash -> field -> count, redis zset -> member -> count.
+        self.hashes = defaultdict(lambda: defaultdict(int))
+        self.zsets = defaultdict(lambda: defaultdict(int))
+        # user leaderboards, written with user ids.
+        self.ranks = defaultdict(lambda: defaultdict(int))
+        self.users = defaultdict(_mongo_default)
+        self.repos = defaultdict(_mongo_default)
+        self.languages = defaultdict(_mongo_default)
+        self.contributors = defaultdict(lambda: defaultdict(int))
+        self.active_langs = defaultdict(set)
+        self.user_months = defaultdict(set)
+
+    def process(self, events, year, month, day, hour):
+        weekday = date(year=year, month=month, day=day).strftime("%w")
+        year_month = "{year}-{month:02d}".format(year=year, month=month)
+        users, repos, languages = self.users, self.repos, self.languages
+        hashes, zsets, ranks = self.hashes, self.zsets, self.ranks
+        for event in events:
+            actor = event["actor"]
+            attrs = event.get("actor_attributes", {})
+            if actor is None or attrs.get("type") != "User":
+                # This was probably an anonymous event (like a gist event)
+                # or an organization event.
+                continue
+
+            # Normalize the user name.
+            key = actor.lower()
+
+            # Get the type of event.
+            evttype = event["type"]
+            nevents = 1
+
+            # Can this be called a "contribution"?
+            contribution = evttype in ["IssuesEvent", "PullRequestEvent",
+                                       "PushEvent"]
+
+            # Increment the global sum histograms.
+            self.total += nevents
+            hashes["day"][weekday] += nevents
+            hashes["hour"][hour] += nevents
+            hashes["month"][year_month] += nevents
+            ranks["user"][key] += nevents
+            zsets["event"][evttype] += nevents
+
+            # Event histograms.
+            hashes["event:{0}:day".format(evttype)][weekday] += nevents
+            hashes["event:{0}:hour".format(evttype)][hour] += nevents
+            hashes["event:{0}:month".format(evttype)][year_month] += nevents
+
+            # User schedule histograms.
+            incs = [
+                'total',
+                'day.%s' % weekday,
+                'hour.%02d' % hour,
+                'month.%04d.%02d' % (year, month),
+                'event.%s.day.%s' % (evttype, weekday),
+                'event.%s.hour.%02d' % (evttype, hour),
+                'event.%s.month.%04d.%02d' % (evttype, year, month)
+            ]
+            for inc in incs:
+                users[key]['$inc'][inc] += nevents
+            self.user_months[key].add(year_month)
+            # Parse the name and owner of the affected repository.
+            repo = event.get("repository", {})
+            owner, name, org = (repo.get("owner"), repo.get("name"),
+                                repo.get("organization"))
+            if owner and name:
+                repo_name = "{0}/{1}".format(owner, name)
+
+                # Save the social graph.
+                users[key]['repos'][repo_name] += nevents
+                repos[repo_name]['$inc']['total'] += nevents
+                repos[repo_name]['$inc']['events.%s' % evttype] += nevents
+                self.contributors[repo_name][key] += nevents
+
+                # Which are the hottest repositories, overall and of the month?
+                zsets["repo"][repo_name] += nevents
+                zsets["month:{0}:repo".format(year_month)][repo_name] += nevents
+
+                # Do we know what the language of the repository is?
+                language = repo.get("language")
+                if language:
+                    # Which are the most popular languages?
+                    languages[language]['$inc']['total'] += nevents
+                    languages[language]['$inc']['events.%s' % evttype] += nevents
+                    languages[language]['$inc']['month.%d.%2d' % (year, month)] += nevents
+                    zsets["lang:{0}:repo".format(language)][repo_name] += nevents
+
+                    # The most used language of users
+                    users[key]['$inc']['lang.%s' % language] += nevents
+                    self.active_langs[(language, year_month)].add(key)
+
+                    # Who are the most important users of a language?
+                    if contribution:
+                        ranks["lang:{0}:user".format(language)][key] += nevents
+
+    def flush(self):
+        pipe = _pipe()
+        if self.total:
+            pipe.incr(_format("total"), self.total)
+        for name, fields in self.hashes.items():
+            for field, count in fields.items():
+                pipe.hincrby(_format(name), field, count)
+        for name, members in self.zsets.items():
+            for member, count in members.items():
+                pipe.zincrby(_format(name), member, count)
+        # Leaderboards are keyed by user ids.
+        users = self.users
+        uids = dict(zip(users, ids.ids(redis(), list(users))))
+        for name, counts in self.ranks.items():
+            for key, count in counts.items():
+                pipe.zincrby(_format(name), uids[key], count)
+        users_stats = mongodb().users_stats
+        for key in users:
+            users_stats.update({'_id': key}, {'$inc': users[key]['$inc']}, True)
+            for repo_name in users[key]['repos']:
+                users_stats.update(
+                    {'_id': key, 'repos.repo': {'$ne': repo_name}},
+                    {'$addToSet': {'repos': {'repo': repo_name, 'events': 0}}},
+                    False
+                )
+                users_stats.update(
+                    {'_id': key, 'repos.repo': repo_name},
+                    {'$inc': {'repos.$.events': users[key]['repos'][repo_name]}},
+                    False
+                )
+        # Distinct active users per language and country of the month.
+        for (language, year_month), names in self.active_langs.items():
+            active.add(pipe, 'lang', language, year_month, names)
+        active_countries = defaultdict(set)
+        names = list(users)
+        for i in range(0, len(names), 1000):
+            for user in users_stats.find({'_id': {'$in': names[i:i + 1000]}, 'loc.country': {'$ne': None}},
+                                         {'loc.country': 1}):
+                for year_month in self.user_months[user['_id']]:
+                    active_countries[(user['loc']['country'], year_month)].add(user['_id'])
+        for (country, year_month), names in active_countries.items():
+            active.add(pipe, 'country', country, year_month, names)
+        languages_stats = mongodb().languages
+        for key in self.languages:
+            languages_stats.update({'_id': key},
+                                   {'$inc': self.languages[key]['$inc']},
+                                   True)
+        repos_stats = mongodb().repositories
+        for key in self.repos:
+            merge_contributors(repos_stats, key, self.contributors[key], self.repos[key]['$inc'])
+        pipe.execute()
+        self.__init__()
+
+
+@decoder.projection(*event_fields, users_only=True)
 def events_process(events, year, month, day, hour):
     '''main events process method.'''
-    weekday = date(year=year, month=month, day=day).strftime("%w")
-    year_month = "{year}-{month:02d}".format(year=year, month=month)
-    pipe = _pipe()
-    users = defaultdict(_mongo_default)
-    repos = defaultdict(_mongo_default)
-    languages = defaultdict(_mongo_default)
-    for event in events:
-        actor = event["actor"]
-        attrs = event.get("actor_attributes", {})
-        if actor is None or attrs.get("type") != "User":
-            # This was probably an anonymous event (like a gist event)
-            # or an organization event.
-            continue
+    aggregator = EventsAggregator()
+    aggregator.process(events, year, month, day, hour)
+    aggregator.flush()
+events_process.aggregator = EventsAggregator
+
 
-        # Normalize the user name.
-        key = actor.lower()
-
-        # Get the type of event.
-        evttype = event["type"]
-        nevents = 1
-
-        # Can this be called a "contribution"?
-        contribution = evttype in ["IssuesEvent", "PullRequestEvent",
-                                   "PushEvent"]
-
-        # Increment the global sum histograms.
-        pipe.incr(_format("total"), nevents)
-        pipe.hincrby(_format("day"), weekday, nevents)
-        pipe.hincrby(_format("hour"), hour, nevents)
-        pipe.hincrby(_format("month"), year_month, nevents)
-        pipe.zincrby(_format("user"), key, nevents)
-        pipe.zincrby(_format("event"), evttype, nevents)
-
-        # Event histograms.
-        pipe.hincrby(_format("event:{0}:day".format(evttype)),
-                     weekday, nevents)
-        pipe.hincrby(_format("event:{0}:hour".format(evttype)),
-                     hour, nevents)
-        pipe.hincrby(_format("evnet:{0}:month".format(evttype)),
-                     year_month, nevents)
-
-        # User schedule histograms.
-        incs = [
-            'total',
-            'day.%s' % weekday,
-            'hour.%02d' % hour,
-            'month.%04d.%02d' % (year, month),
-            'event.%s.day.%s' % (evttype, weekday),
-            'event.%s.hour.%02d' % (evttype, hour),
-            'event.%s.month.%04d.%02d' % (evttype, year, month)
-        ]
-        for inc in incs:
-            users[key]['$inc'][inc] += nevents
-        # Parse the name and owner of the affected repository.
-        repo = event.get("repository", {})
-        owner, name, org = (repo.get("owner"), repo.get("name"),
-                            repo.get("organization"))
-        if owner and name:
-            repo_name = "{0}/{1}".format(owner, name)
-
-            # Save the social graph.
-            users[key]['repos'][repo_name] += nevents
-            repos[repo_name]['$inc']['total'] += nevents
-            repos[repo_name]['$inc']['events.%s' % evttype] += nevents
-            repos[repo_name]['$inc']['users.%s' % key] += nevents
-
-            # Do we know what the language of the repository is?
-            language = repo.get("language")
-            if language:
-                # Which are the most popular languages?
-                languages[language]['$inc']['total'] += nevents
-                languages[language]['$inc']['events.%s' % evttype] += nevents
-                languages[language]['$inc']['month.%d.%2d' % (year, month)] += nevents
+def merge_contributors(repos_stats, repo_name, counts, inc=None, retries=12):
+    '''fold a contributor tally into the repo's top contributors sketch.
 
+    inc is applied to the repo in the same round trip that reads the sketch.
+    Raises RuntimeError when concurrent merges keep winning, so the hours are
+    not marked as processed.
+    '''
+    if inc:
+        repo = repos_stats.find_and_modify({'_id': repo_name}, {'$inc': inc}, upsert=True, new=True,
+                                           fields={'contributors': 1})
+    else:
+        repo = repos_stats.find_one({'_id': repo_name}, {'contributors': 1})
+    for i in range(retries):
+        doc = (repo or {}).get('contributors') or {}
+        sketch = SpaceSaving.from_doc(doc, REPO_CONTRIBUTORS_K).update(counts)
+        value = sketch.to_doc()
+        value['v'] = doc.get('v', 0) + 1
+        # compare-and-set on the sketch version, other hours may be merging concurrently.
+        result = repos_stats.update({'_id': repo_name, 'contributors.v': doc.get('v')},
+                                    {'$set': {'contributors': value}},
+                                    False)
+        if result is None or result.get('n'):
+            return True
+        time.sleep(random.uniform(0, 0.01 * 2 ** i))
+        repo = repos_stats.find_one({'_id': repo_name}, {'contributors': 1})
+    raise RuntimeError("Giving up merging contributors of %s." % repo_name)
+
+
+class LangContribAggregator(object):
+    '''Contributions per user, language and month of one or more hours.'''
+
+    def __init__(self):
+        self.users = defaultdict(_mongo_default)
+
+    def process(self, events, year, month, day, hour):
+        users = self.users
+        for event in events:
+            actor = event["actor"]
+            attrs = event.get("actor_attributes", {})
+            if actor is None or attrs.get("type") != "User":
+                # This was probably an anonymous event (like a gist event)
+                # or an organization event.
+                continue
+
+            # Normalize the user name.
+            key = actor.lower()
+
+            # Get the type of event.
+            evttype = event["type"]
+            nevents = 1
+
+            # Can this be called a "contribution"?
+            contribution = evttype in ["IssuesEvent", "PullRequestEvent", "PushEvent"]
+
+            repo = event.get("repository", {})
+            owner, name, org, language = (repo.get("owner"),
+                                          repo.get("name"),
+                                          repo.get("organization"),
+                                          repo.get("language"))
+            if owner and name and language and contribution:
                 # The most used language of users
-                users[key]['$inc']['lang.%s' % language] += nevents
-
-                # Who are the most important users of a language?
-                if contribution:
-                    pipe.zincrby(_format("lang:{0}:user".format(language)),
-                                 key, nevents)
-    users_stats = mongodb().users_stats
-    for key in users:
-        users_stats.update({'_id': key}, {'$inc': users[key]['$inc']}, True)
-        for repo_name in users[key]['repos']:
-            users_stats.update(
-                {'_id': key, 'repos.repo': {'$ne': repo_name}},
-                {'$addToSet': {'repos': {'repo': repo_name, 'events': 0}}},
-                False
-            )
-            users_stats.update(
-                {'_id': key, 'repos.repo': repo_name},
-                {'$inc': {'repos.$.events': users[key]['repos'][repo_name]}},
-                False
-            )
-    del users
-    languages_stats = mongodb().languages
-    for key in languages:
-        languages_stats.update({'_id': key},
-                               {'$inc': languages[key]['$inc']},
-                               True)
-    del languages
-    repos_stats = mongodb().repositories
-    for key in repos:
-        repos_stats.update({'_id': key},
-                           {'$inc': repos[key]['$inc']},
-                           True)
-    del repos
-    pipe.execute()
+                users[key]['$inc']['contrib.%s.%d.%02d' % (language, year, month)] += nevents
 
+    def flush(self):
+        users_stats = mongodb().users_stats
+        for key in self.users:
+            users_stats.update({'_id': key}, {'$inc': self.users[key]['$inc']}, True)
+        self.__init__()
 
+
+@decoder.projection(*event_fields, users_only=True)
 def events_process_lang_contrib(events, year, month, day, hour):
     '''lang contribution process method.'''
-    users = defaultdict(_mongo_default)
-    for event in events:
-        actor = event["actor"]
-        attrs = event.get("actor_attributes", {})
-        if actor is None or attrs.get("type") != "User":
-            # This was probably an anonymous event (like a gist event)
-            # or an organization event.
-            continue
-
-        # Normalize the user name.
-        key = actor.lower()
-
-        # Get the type of event.
-        evttype = event["type"]
-        nevents = 1
-
-        # Can this be called a "contribution"?
-        contribution = evttype in ["IssuesEvent", "PullRequestEvent", "PushEvent"]
-
-        repo = event.get("repository", {})
-        owner, name, org, language = (repo.get("owner"),
-                                      repo.get("name"),
-                                      repo.get("organization"),
-                                      repo.get("language"))
-        if owner and name and language and contribution:
-            # The most used language of users
-            users[key]['$inc']['contrib.%s.%d.%02d' % (language, year, month)] += nevents
-
-    users_stats = mongodb().users_stats
-    for key in users:
-        users_stats.update({'_id': key}, {'$inc': users[key]['$inc']}, True)
-    del users
+    aggregator = LangContribAggregator()
+    aggregator.process(events, year, month, day, hour)
+    aggregator.flush()
+events_process_lang_contrib.aggregator = LangContribAggregator
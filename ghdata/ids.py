@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Username <-> integer id dictionary.
+
+Leaderboard zsets store the integer ids instead of the usernames. The
+dictionary lives in redis ("uid:ids" name -> id, "uid:names" id -> name,
+"uid:next" counter), with a bounded per process cache in front of it which
+drops its oldest entries first. Redis is asked about CHUNK names at a time,
+so a large flush never blocks it for long.
+'''
+
+from collections import OrderedDict
+
+from .db import format_key as _format
+
+__all__ = ["ids", "names"]
+
+CACHE_SIZE = 200000
+CHUNK = 1000
+
+# prefix -> ({name: id}, {id: name}), every namespace has its own ids.
+_caches = {}
+
+# Look up or allocate the ids of ARGV atomically.
+_assign_lua = """
+local result = {}
+for i, name in ipairs(ARGV) do
+    local id = redis.call('HGET', KEYS[1], name)
+    if not id then
+        id = redis.call('INCR', KEYS[3])
+        redis.call('HSET', KEYS[1], name, id)
+        redis.call('HSET', KEYS[2], id, name)
+    end
+    result[i] = id
+end
+return result
+"""
+_assign = None
+
+
+def _cache():
+    return _caches.setdefault(_format(''), (OrderedDict(), {}))
+
+
+def _add(name, id):
+    _ids, _names = _cache()
+    while len(_ids) >= CACHE_SIZE:
+        _names.pop(_ids.popitem(last=False)[1], None)
+    _ids[name], _names[id] = id, name
+
+
+def ids(r, usernames, create=True):
+    '''ids (as strings) of the lowercase usernames, None for unknown ones if not create.'''
+    global _assign
+    _ids = _cache()[0]
+    missing = list(set(n for n in usernames if n not in _ids))
+    if missing:
+        if create and _assign is None:
+            _assign = r.register_script(_assign_lua)
+        found = {}
+        for i in range(0, len(missing), CHUNK):
+            chunk = missing[i:i + CHUNK]
+            if create:
+                values = _assign(keys=[_format('uid:ids'), _format('uid:names'), _format('uid:next')],
+                                 args=chunk, client=r)
+            else:
+                values = r.hmget(_format('uid:ids'), chunk)
+            found.update((name, str(id)) for name, id in zip(chunk, values) if id is not None)
+        for name, id in found.items():
+            _add(name, id)
+        # entries may have been evicted while adding.
+        return [_ids.get(n) or found.get(n) for n in usernames]
+    return [_ids.get(n) for n in usernames]
+
+
+def names(r, user_ids):
+    '''usernames of ids, None for unknown ones.'''
+    user_ids = [str(i) for i in user_ids]
+    _names = _cache()[1]
+    missing = list(set(i for i in user_ids if i not in _names))
+    if missing:
+        found = {}
+        for i in range(0, len(missing), CHUNK):
+            chunk = missing[i:i + CHUNK]
+            found.update((id, name) for id, name in zip(chunk, r.hmget(_format('uid:names'), chunk))
+                         if name is not None)
+        for id, name in found.items():
+            _add(name, id)
+        return [_names.get(i) or found.get(i) for i in user_ids]
+    return [_names.get(i) for i in user_ids]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Similar developers and related repositories from the contribution graph.
+
+users_stats "repos" arrays give a sparse users x repos matrix weighted by
+log(1 + events). Rows are L2 normalized, so a product of row blocks with
+the transposed matrix gives cosine similarities. The products are computed
+a block of rows at a time and only the top k neighbors of each row are
+kept, which bounds the memory by the block size instead of the graph size.
+'''
+
+from array import array
+
+import numpy as np
+import scipy.sparse as sp
+
+__all__ = ["load", "neighbors", "build"]
+
+
+def load(users_stats):
+    '''(matrix, user names, repo names) of the users x repos graph.'''
+    users, repos, repo_ids = [], [], {}
+    rows, cols, data = array('i'), array('i'), array('f')
+    for user in users_stats.find({'repos': {'$ne': None}, 'robot': {'$ne': True}}, {'repos': 1}):
+        row = len(users)
+        users.append(user['_id'])
+        for repo in user['repos']:
+            if repo.get('events', 0) <= 0:
+                continue
+            col = repo_ids.get(repo['repo'])
+            if col is None:
+                col = repo_ids[repo['repo']] = len(repos)
+                repos.append(repo['repo'])
+            rows.append(row)
+            cols.append(col)
+            data.append(repo['events'])
+    matrix = sp.csr_matrix((np.log1p(np.frombuffer(data, dtype=np.float32)),
+                            (np.frombuffer(rows, dtype=np.int32), np.frombuffer(cols, dtype=np.int32))),
+                           shape=(len(users), len(repos)))
+    return matrix, users, repos
+
+
+def _normalize(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.diags(1 / norms, 0).dot(matrix).tocsr()
+
+
+def neighbors(matrix, k=20, chunk=1000, max_degree=None):
+    '''yield (row, [(other row, similarity), ...]) with the top k of each row.
+
+    Columns shared by more than max_degree rows are left out: they link
+    almost everyone and make the block products dense.
+    '''
+    if max_degree:
+        degree = np.diff(matrix.tocsc().indptr)
+        keep = sp.diags((degree <= max_degree).astype(np.float32), 0)
+        matrix = matrix.dot(keep)
+    matrix = _normalize(matrix)
+    transposed = matrix.T.tocsr()
+    for start in range(0, matrix.shape[0], chunk):
+        block = matrix[start:start + chunk].dot(transposed).tocsr()
+        for i in range(block.shape[0]):
+            row = start + i
+            lo, hi = block.indptr[i], block.indptr[i + 1]
+            indices, scores = block.indices[lo:hi], block.data[lo:hi]
+            mask = indices != row
+            indices, scores = indices[mask], scores[mask]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                indices, scores = indices[top], scores[top]
+            order = np.argsort(-scores)
+            yield row, [(int(indices[j]), float(scores[j])) for j in order]
+
+
+def _store(collection, docs, batch=1000):
+    '''write docs into a fresh collection and swap it in place of collection.'''
+    tmp = collection.database['%s_tmp' % collection.name]
+    tmp.drop()
+    buf, count = [], 0
+    for doc in docs:
+        buf.append(doc)
+        count += 1
+        if len(buf) == batch:
+            tmp.insert(buf)
+            buf = []
+    buf and tmp.insert(buf)
+    if count:
+        tmp.rename(collection.name, dropTarget=True)
+    else:
+        collection.drop()
+
+
+def build(mongodb, k=20, chunk=1000, max_degree=10000):
+    '''compute and store the related_users and related_repos collections.'''
+    matrix, users, repos = load(mongodb.users_stats)
+    _store(mongodb.related_users,
+           ({'_id': users[row], 'related': [{'user': users[j], 'score': s} for j, s in top]}
+            for row, top in neighbors(matrix, k, chunk, max_degree) if top))
+    _store(mongodb.related_repos,
+           ({'_id': repos[row], 'related': [{'repo': repos[j], 'score': s} for j, s in top]}
+            for row, top in neighbors(matrix.T.tocsr(), k, chunk, max_degree) if top))
+    return len(users), len(repos)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Mongo indexes and query plan checks.
+
+    python -m ghdata.schema ensure
+    python -m ghdata.schema explain
+
+INDEXES declares the indexes of every collection, ensure() builds them in
+the background. queries() lists the hot queries, explain() runs each of them
+through the query planner and flags the ones which scan a whole collection
+without being meant to. "contrib" is not indexed: it is a whole subdocument
+per user and only ever tested against null, after loc.country narrowed the
+users down. The languages sort key changes every month and the collection
+holds a few hundred documents, so it is scanned on purpose.
+'''
+
+import sys
+from datetime import datetime
+
+from .db import mongodb as _mongodb
+
+__all__ = ["INDEXES", "queries", "ensure", "explain", "report"]
+
+# collection -> [(keys, options)]
+INDEXES = {
+    'users_stats': [
+        # country_rank, user_rank ("robot" $ne True rides along).
+        ([('loc.country', 1), ('robot', 1)], {}),
+        # city_rank.
+        ([('loc.city', 1)], {}),
+        # update_users_location.
+        ([('info.location', 1)], {}),
+    ],
+}
+
+
+def queries():
+    '''[(name, collection, spec, sort, scan intended)] of the hot queries.'''
+    now = datetime.now()
+    year, month = (now.year-1, 12) if now.month == 1 else (now.year, now.month-1)
+    return [
+        ('country_rank', 'users_stats', {'loc.country': {'$ne': None}}, None, False),
+        ('city_rank', 'users_stats', {'loc.city': {'$ne': None}}, None, False),
+        ('user_rank', 'users_stats', {'loc.country': 'China', 'contrib': {'$ne': None}, 'robot': {'$ne': True}},
+         None, False),
+        ('update_users_location', 'users_stats', {'info.location': {'$ne': None}}, None, False),
+        ('users', 'users_stats', {'_id': 'torvalds'}, None, False),
+        ('translate', 'translation', {'_id': 'China', 'zh': {'$ne': None}}, None, False),
+        ('geo_info', 'locations', {'_id': 'Beijing'}, None, False),
+        ('repos_rank', 'repositories', {'_id': {'$in': ['torvalds/linux']}}, None, False),
+        ('top_languages', 'languages', {}, [('month.%d.%2d' % (year, month), -1)], True),
+        ('related', 'users_stats', {'repos': {'$ne': None}, 'robot': {'$ne': True}}, None, True),
+    ]
+
+
+def ensure(mongodb=None):
+    '''build the missing indexes in the background, return their names.'''
+    mongodb = mongodb or _mongodb()
+    names = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            names.append(mongodb[collection].create_index(keys, background=True, **options))
+    return names
+
+
+def _plan(explained):
+    '''(description, whether a whole collection is scanned) of an explain output.'''
+    if 'queryPlanner' in explained:
+        stages, stage = [], explained['queryPlanner']['winningPlan']
+        while stage:
+            stages.append(stage['stage'] + (' %s' % stage['indexName'] if 'indexName' in stage else ''))
+            stage = stage.get('inputStage')
+        return ' <- '.join(stages), any(s == 'COLLSCAN' for s in stages)
+    cursors = [explained['cursor']] + [c['cursor'] for c in explained.get('clauses', [])]
+    return ', '.join(cursors), any(c.startswith('BasicCursor') for c in cursors)
+
+
+def explain(mongodb=None):
+    '''[(name, collection, plan, scan, intended)] of the hot queries.'''
+    mongodb = mongodb or _mongodb()
+    result = []
+    for name, collection, spec, sort, intended in queries():
+        cursor = mongodb[collection].find(spec)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan, scan = _plan(cursor.limit(1).explain())
+        result.append((name, collection, plan, scan, intended))
+    return result
+
+
+def report(plans):
+    '''print the plans, return the number of unintended collection scans.'''
+    flagged = 0
+    for name, collection, plan, scan, intended in plans:
+        flag = ''
+        if scan:
+            flag = 'scan (intended)' if intended else 'COLLECTION SCAN'
+            flagged += not intended
+        print('%-22s %-14s %-40s %s' % (name, collection, plan, flag))
+    return flagged
+
+
+def main(argv):
+    command = argv[0] if argv else 'ensure'
+    if command == 'ensure':
+        for name in ensure():
+            print(name)
+    elif command == 'explain':
+        return 1 if report(explain()) else 0
+    else:
+        print(__doc__)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
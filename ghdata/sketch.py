@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__all__ = ["SpaceSaving"]
+
+
+class SpaceSaving(object):
+    '''Bounded heavy-hitters summary (Space-Saving, Metwally et al.).
+
+    At most k counters are kept. Every reported count over-estimates the
+    true count by no more than its error, and the error of any counter is
+    bounded by total/k. Summaries are mergeable, so hourly tallies can be
+    folded into the stored one in any order.
+    '''
+
+    def __init__(self, k, counters=None, total=0):
+        self.k = k
+        self.total = total
+        # item -> [count, error]
+        self.counters = dict((item, [count, error]) for item, count, error in counters or [])
+
+    @classmethod
+    def from_doc(cls, doc, k):
+        doc = doc or {}
+        return cls(k, doc.get('items', []), doc.get('n', 0))
+
+    def to_doc(self):
+        return {'k': self.k, 'n': self.total, 'items': [list(t) for t in self.top()]}
+
+    def min_count(self):
+        '''upper bound of the count of any item not being tracked.'''
+        if len(self.counters) < self.k:
+            return 0
+        return min(c[0] for c in self.counters.values())
+
+    def offer(self, item, count=1):
+        self.total += count
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif len(self.counters) < self.k:
+            self.counters[item] = [count, 0]
+        else:
+            victim = min(self.counters, key=lambda i: self.counters[i][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + count, floor]
+
+    def merge(self, other):
+        '''fold another summary into this one, keeping the k largest counters.'''
+        m1, m2 = self.min_count(), other.min_count()
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            c1, e1 = self.counters.get(item, (m1, m1))
+            c2, e2 = other.counters.get(item, (m2, m2))
+            merged[item] = [c1 + c2, e1 + e2]
+        top = sorted(merged.items(), key=lambda t: t[1][0], reverse=True)[:self.k]
+        self.counters = dict(top)
+        self.total += other.total
+        return self
+
+    def update(self, counts):
+        '''merge an exact {item: count} tally.'''
+        # one spare counter keeps min_count() at 0: nothing untracked was seen.
+        exact = SpaceSaving(len(counts) + 1,
+                            [(item, count, 0) for item, count in counts.items()],
+                            sum(counts.values()))
+        return self.merge(exact)
+
+    def top(self, n=None):
+        '''[(item, count, error), ...] sorted by count, descending.'''
+        items = sorted(self.counters.items(), key=lambda t: (-t[1][0], t[0]))
+        return [(item, c[0], c[1]) for item, c in items[:n]]
+
+    def guaranteed(self, n=None):
+        '''top items whose rank is certain: count - error >= next largest count.'''
+        top = self.top()
+        result = []
+        for i, (item, count, error) in enumerate(top[:n]):
+            following = top[i + 1][1] if i + 1 < len(top) else self.min_count()
+            result.append((item, count, error, count - error >= following))
+        return result
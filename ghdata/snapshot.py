@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Pre-rendered /rank pages and /languages list.
+
+Every page is written once as gzipped JSON named by its content hash, and
+manifest.json maps "rank:<country>:<lang>:<page>" and "languages" to
+those files. The manifest is replaced atomically, so readers always see a
+complete set of pages.
+'''
+
+import os
+import gzip
+import json
+import hashlib
+import StringIO
+from datetime import datetime
+from bson import json_util
+
+from .config import SNAPSHOT_DIR
+from .db import format_key as _format, namespace
+from . import ids
+
+__all__ = ["PAGE_COUNT", "rank_page", "top_languages", "publish", "read_manifest", "manifest_key",
+           "directory"]
+
+PAGE_COUNT = 50
+MANIFEST = 'manifest.json'
+
+
+def manifest_key(*parts):
+    return ':'.join(['rank'] + [str(p) for p in parts]) if parts else 'languages'
+
+
+def rank_page(lang, country, page, page_count, rdb, mongodb):
+    '''one page of the users ranking of a language in a country.'''
+    key = _format("country:{0}.lang:{1}:user".format(country, lang))
+    total = rdb.zcard(key)
+    pages = total/page_count + (total % page_count and 1)
+    uids = rdb.zrevrange(key, page*page_count, (page+1)*page_count - 1)
+    w_key = _format("lang:{0}:user".format(lang))
+    pipe = rdb.pipeline()
+    for u in uids:
+        pipe.zrevrank(w_key, u)
+    w_ranks = pipe.execute()
+    data = [mongodb.users_stats.find_one({'_id': u}, {'info': 1, 'contrib': 1}) for u in ids.names(rdb, uids)]
+    for i, (user, wr) in enumerate(zip(data, w_ranks)):
+        user['rank'] = {country: page_count*page + i + 1, 'world': wr + 1}
+    return {
+        'pages': pages,
+        'page': page,
+        'page_count': page_count,
+        'language': lang,
+        'country': country,
+        'data': data
+    }
+
+
+def top_languages(mongodb, count=20):
+    now = datetime.now()
+    year, month = (now.year-1, 12) if now.month == 1 else (now.year, now.month-1)
+    key = 'month.%d.%2d' % (year, month)
+    # get languages sorted by activity of last month in the world.
+    return [lang['_id'] for lang in mongodb.languages.find().sort(key, -1).limit(count)]
+
+
+def directory(ns=None):
+    '''snapshots of a namespace, the active one by default.'''
+    return os.path.join(SNAPSHOT_DIR, (ns or namespace())['prefix'])
+
+
+def _write(obj, path):
+    '''write obj as gzipped json, return (file name, etag).'''
+    content = json_util.dumps(obj, sort_keys=True)
+    etag = hashlib.sha1(content).hexdigest()
+    fn = '%s.json.gz' % etag
+    full = os.path.join(path, fn)
+    if not os.path.exists(full):
+        buf = StringIO.StringIO()
+        # fixed mtime keeps the compressed bytes stable for the same content.
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+            f.write(content)
+        with open(full + '.tmp', 'wb') as f:
+            f.write(buf.getvalue())
+        os.rename(full + '.tmp', full)
+    return fn, etag
+
+
+def read_manifest(path=None):
+    path = path or directory()
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def publish(langs, countries, rdb, mongodb, path=None):
+    '''render all ranking pages of countries x langs and swap the manifest.'''
+    path = path or directory()
+    os.path.exists(path) or os.makedirs(path)
+    manifest = {}
+    manifest[manifest_key()] = _write({'data': top_languages(mongodb)}, path)
+    for country in countries:
+        for lang in langs:
+            page, pages = 0, 1
+            while page < pages:
+                data = rank_page(lang, country, page, PAGE_COUNT, rdb, mongodb)
+                manifest[manifest_key(country, lang, page)] = _write(data, path)
+                pages = data['pages']
+                page += 1
+    previous = read_manifest(path)
+    tmp = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.rename(tmp, os.path.join(path, MANIFEST))
+    # keep the files of the previous manifest for readers still holding it.
+    keep = set(v[0] for m in [manifest, previous] for v in m.values())
+    for fn in os.listdir(path):
+        if fn.endswith('.json.gz') and fn not in keep:
+            os.remove(os.path.join(path, fn))
+    return len(manifest)
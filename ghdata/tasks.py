@@ -5,23 +5,31 @@ from __future__ import absolute_import
 
 from .worker import worker as w, logger
 
-import requests
 import time
+import json
 from datetime import datetime, timedelta
 import functools
 import math
 from collections import defaultdict
-from translate import Translator
-from celery import group
+from celery import signature
 
-from .config import GITHUB_CRENDENTIALS
+from .config import GITHUB_CRENDENTIALS, ARCHIVE_PACK, ARCHIVE_MAX_BYTES, NAMESPACE_GC_DELAY, RECOMPUTE_TTL
+from .config import FETCH_BATCH_HOURS, FETCH_MAX_PENDING, FETCH_DISPATCH_DELAY, MONTH_REPO_RANK_SIZE
 from .db import mongodb, redis, format_key as _format
-from .geo import geo_info
-from .fetch import fetch_one, events_process, file_process, events_process_lang_contrib
+from .db import namespace, default_namespace, use_namespace, set_namespace, control_key
+from . import active
+from . import ids
+from . import archive
+from .fetch import fetch_one, events_process, file_process, events_process_lang_contrib, merge_contributors, processed
+from .fetch import hours_process, unprocessed
 
 ghapi_url = "https://api.github.com/users/{username}"
 search_url = 'https://api.github.com/search/repositories'
 geoname_url = "http://api.geonames.org/search"
+# Processors run over every archived hour.
+processors = [events_process, events_process_lang_contrib]
+# The first hour of the timeline.
+TIMELINE_START = datetime(2012, 3, 1)
 
 
 def concurrency(n):
@@ -40,16 +48,35 @@ def concurrency(n):
                 pass
             finally:
                 r.hincrby(key, fn.__name__, -1)
+        wrap.__wrapped__ = fn
         return wrap
     return wrapper
 
 
+def namespaced(fn):
+    '''run in the namespace given by the ns keyword, or the one active when starting.'''
+    @functools.wraps(fn)
+    def wrap(*args, **kwargs):
+        with use_namespace(kwargs.pop('ns', None) or namespace()):
+            return fn(*args, **kwargs)
+    wrap.__wrapped__ = fn
+    return wrap
+
+
+def _body(task):
+    '''the function under the decorators of a task, which lets errors through.'''
+    fn = task.run
+    while hasattr(fn, '__wrapped__'):
+        fn = fn.__wrapped__
+    return fn
+
+
 @w.task
 def update_user(index, step):
     '''update user's info from github'''
     r = redis()
-    users = r.zrevrange(_format("user"), index, index)
-    if len(users) > 0:
+    users = ids.names(r, r.zrevrange(_format("user"), index, index))
+    if len(users) > 0 and users[0]:
         logger.info("Updating %s at %d." % (users[0], index))
         count = 0
         r.set(_format('update:users:index:%d' % (index % step)), index, 7200)
@@ -69,6 +96,7 @@ def _update_user(username):
     etag = info.get("etag", None)
     location = info.get("location", None)
 
+    import requests
     r = None
     try:
         # Work out the authentication headers.
@@ -114,6 +142,7 @@ def update_location(location, username=None):
 
     loc = locations.find_one({"_id": location})
     if not loc:
+        from .geo import geo_info
         loc = {"_id": location}
         loc.update(geo_info(location) or {})
         locations.update({"_id": location}, loc, True)
@@ -125,7 +154,13 @@ def update_location(location, username=None):
             'city': loc.get('locality', {}).get('long_name', None),
             'timezone': loc.get('timezone', 0)
         }
-        mongodb().users_stats.update({'_id': username}, {'$set': {'loc': loc_info}})
+        users_stats = mongodb().users_stats
+        users_stats.update({'_id': username}, {'$set': {'loc': loc_info}})
+        if loc_info['country']:
+            user = users_stats.find_one({'_id': username}, {'month': 1}) or {}
+            pipe = redis().pipeline()
+            active.add_user_months(pipe, loc_info['country'], username, user.get('month'))
+            pipe.execute()
 
 
 @w.task(ignore_result=True)
@@ -209,6 +244,7 @@ def save_repos(repos):
 
 
 def _search_repos(url, params):
+    import requests
     r = None
     try:
         r = requests.get(url, params=params, timeout=60)
@@ -236,20 +272,214 @@ def fetch_timeline(year=2012, month=3, day=1):
     '''worker process to go through all timeline data since 2012/3/1.'''
     since = datetime(year, month, day)
     hours = int((datetime.today() - since).total_seconds() / 3600)
-    times = (since + timedelta(hours=i) for i in range(hours))
-    group(fetch_worker.s(h.year, h.month, h.day, h.hour) for h in times)()
+    dispatch_hours.delay((year, month, day, 0), hours)
+
+
+@w.task(ignore_result=True)
+@namespaced
+def dispatch_hours(start, count, batch=None, callback=None):
+    '''queue fetch_range tasks for count hours since start (year, month, day, hour).
+
+    No more than FETCH_MAX_PENDING tasks are left waiting in the fetch queue,
+    the rest is dispatched by a later run. Once a batch is dispatched and all
+    of its tasks finished, callback is applied.
+    '''
+    r = redis()
+    since = datetime(*start)
+    free = FETCH_MAX_PENDING - r.llen('fetch')
+    done = 0
+    while done < count and free > 0:
+        n = min(FETCH_BATCH_HOURS, count - done)
+        first = since + timedelta(hours=done)
+        pipe = r.pipeline()
+        for h in (first + timedelta(hours=i) for i in range(n)):
+            for fn in processors:
+                pipe.sismember(_format('function:%s' % fn.__name__), archive.hour_key(h.year, h.month, h.day, h.hour))
+        if not all(pipe.execute()):
+            batch and r.hincrby(_format('dispatch:%s' % batch), 'pending', 1)
+            fetch_range.delay((first.year, first.month, first.day, first.hour), n, batch=batch, ns=namespace())
+            free -= 1
+        done += n
+    if done < count:
+        rest = since + timedelta(hours=done)
+        dispatch_hours.apply_async(((rest.year, rest.month, rest.day, rest.hour), count - done),
+                                   {'batch': batch, 'callback': callback, 'ns': namespace()},
+                                   countdown=FETCH_DISPATCH_DELAY)
+    elif batch:
+        r.hmset(_format('dispatch:%s' % batch), {'callback': json.dumps(callback), 'done': 1})
+        _batch_finished(r, batch)
+
+
+def _batch_finished(r, batch):
+    '''apply the callback of a batch once, when everything is dispatched and done.'''
+    key = _format('dispatch:%s' % batch)
+    state = r.hgetall(key)
+    if state.get('done') and int(state.get('pending', 0)) <= 0 and r.hsetnx(key, 'fired', 1):
+        r.expire(key, 3600 * 24)
+        callback = json.loads(state.get('callback') or 'null')
+        callback and signature(callback).delay()
+
+
+def _claim(r, keys, ttl):
+    '''claim the hours for processing, return the ones no other task holds.'''
+    pipe = r.pipeline()
+    for key in keys:
+        pipe.set(_format('claim:%s' % key), 1, nx=True, ex=ttl)
+    return [key for key, claimed in zip(keys, pipe.execute()) if claimed]
+
+
+def _release(r, keys):
+    keys and r.delete(*[_format('claim:%s' % key) for key in keys])
+
+
+@w.task(ignore_result=True, soft_time_limit=3600 * 8, time_limit=3600 * 8 + 600)
+@namespaced
+def fetch_range(start, count, batch=None):
+    '''fetch and process count consecutive hours since start (year, month, day, hour).
+
+    Hours are claimed first, so overlapping dispatches never process an hour
+    twice. A claim outlives the task by its time limit at most.
+    '''
+    r = redis()
+    since = datetime(*start)
+    claimed = []
+    try:
+        keys = [archive.hour_key(h.year, h.month, h.day, h.hour)
+                for h in (since + timedelta(hours=i) for i in range(count))]
+        # evicted hours are processed already, don't download them again.
+        pending = unprocessed(keys, processors, r)
+        todo = set(k for ks in pending.values() for k in ks)
+        claimed = _claim(r, [key for key in keys if key in todo], 3600 * 8 + 600)
+        fetched = [fetch_one(*archive.parse(key)) for key in claimed]
+        hours_process([key for key in fetched if key], processors, pending)
+    except Exception as e:
+        logger.error("Error during processing %d hrs since %s: %s" % (count, since, e))
+    finally:
+        _release(r, claimed)
+        if batch:
+            r.hincrby(_format('dispatch:%s' % batch), 'pending', -1)
+            _batch_finished(r, batch)
 
 
-@w.task(time_limit=3600 * 4)
+@w.task(soft_time_limit=3600 * 4, time_limit=3600 * 4 + 600)
+@namespaced
 def fetch_worker(year, month, day, hour):
     '''fetch one hour's timeline data and save it to db.'''
+    r = redis()
+    key = archive.hour_key(year, month, day, hour)
+    claimed = []
     try:
-        file_process(fetch_one(year, month, day, hour), [events_process, events_process_lang_contrib])
+        # evicted hours are processed already, don't download them again.
+        if not processed(key, processors, r):
+            claimed = _claim(r, [key], 3600 * 4 + 600)
+            claimed and file_process(fetch_one(year, month, day, hour), processors)
     except Exception as e:
         logger.error("Error during processing %d-%d-%d %d hr: %s" % (year, month, day, hour, e))
+    finally:
+        _release(r, claimed)
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def verify_archive():
+    '''check the archived hours and fetch the corrupt ones again.'''
+    corrupt = archive.verify()
+    logger.info("%d corrupt archived hours." % len(corrupt))
+    for key in corrupt:
+        fetch_one(*archive.parse(key)) or logger.error("Fetching %s again failed." % key)
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def maintain_archive():
+    '''index loose files, pack finished periods and evict processed hours beyond the size limit.'''
+    logger.info("Indexed %d loose archived hours." % archive.reindex())
+    if ARCHIVE_PACK:
+        logger.info("Packed %d archived hours." % archive.pack(ARCHIVE_PACK))
+    if ARCHIVE_MAX_BYTES:
+        r = redis()
+        evicted = archive.evict(ARCHIVE_MAX_BYTES, lambda key: processed(key, processors, r))
+        logger.info("Evicted %d archived hours." % evicted)
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def migrate_repo_contributors():
+    '''move the unbounded users.<name> counters of repositories into contributor sketches.'''
+    repos_stats = mongodb().repositories
+    for repo in repos_stats.find({'users': {'$exists': True}}, {'users': 1}):
+        if merge_contributors(repos_stats, repo['_id'], repo['users']):
+            repos_stats.update({'_id': repo['_id']}, {'$unset': {'users': 1}})
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def migrate_event_month_keys():
+    '''merge the misspelled evnet:<type>:month histograms into event:<type>:month.'''
+    r = redis()
+    for old_key in r.scan_iter(match=_format('evnet:*:month')):
+        new_key = old_key.replace(_format('evnet:'), _format('event:'), 1)
+        if not r.renamenx(old_key, new_key):
+            pipe = r.pipeline()
+            for field, value in r.hgetall(old_key).items():
+                pipe.hincrby(new_key, field, int(value))
+            pipe.delete(old_key).execute()
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def migrate_user_ids():
+    '''rewrite the username members of the leaderboards as user ids, once.
+
+    Run it with ingestion and ranking stopped. Migrated keys are recorded,
+    so an interrupted run resumes where it stopped.
+    '''
+    r = redis()
+    if r.exists(_format('uid:migrated')):
+        return
+    done = _format('uid:migrated:keys')
+    # list the keys first, renamed keys may show up again in a running scan.
+    keys = [key for key in r.scan_iter(match=_format('*user'))
+            if r.type(key) == 'zset' and not r.sismember(done, key)]
+    for key in keys:
+        logger.info("Migrating %s to user ids." % key)
+        t_key = '%s:migrate' % key
+        r.delete(t_key)
+        pipe = r.pipeline()
+        batch = []
+        for member in r.zscan_iter(key, count=1000):
+            batch.append(member)
+            if len(batch) == 1000:
+                for uid, (name, score) in zip(ids.ids(r, [n for n, s in batch]), batch):
+                    pipe.zadd(t_key, uid, score)
+                pipe.execute()
+                batch = []
+        for uid, (name, score) in zip(ids.ids(r, [n for n, s in batch]), batch):
+            pipe.zadd(t_key, uid, score)
+        pipe.rename(t_key, key).sadd(done, key).execute()
+    r.pipeline().set(_format('uid:migrated'), int(time.time())).delete(done).execute()
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def migrate_repo_rank():
+    '''seed the repository leaderboards from the totals of the repositories collection.
+
+    Monthly leaderboards only start with the hours processed from now on.
+    '''
+    pipe = redis().pipeline()
+    for i, repo in enumerate(mongodb().repositories.find({'total': {'$gt': 0}},
+                                                         {'total': 1, 'info.language': 1})):
+        pipe.zadd(_format("repo"), repo['_id'], repo['total'])
+        language = repo.get('info', {}).get('language')
+        if language:
+            pipe.zadd(_format("lang:{0}:repo".format(language)), repo['_id'], repo['total'])
+        i % 1000 or pipe.execute()
+    pipe.execute()
 
 
 @w.task(time_limit=3600 * 8)
+@namespaced
 @concurrency(1)
 def country_rank():
     '''Activities per country and month.'''
@@ -289,6 +519,7 @@ def country_rank():
 
 
 @w.task(time_limit=3600 * 8)
+@namespaced
 @concurrency(1)
 def city_rank():
     '''Activities per city and month.'''
@@ -336,6 +567,7 @@ def translate(text, to_lang='zh'):
     result = t and t[to_lang]
     if not result:
         try:
+            from translate import Translator
             result = Translator(to_lang=to_lang, from_lang='en').translate(text.encode('utf8'))
             translation.update({'_id': text}, {'$set': {to_lang: result}}, True)
         except:
@@ -344,6 +576,7 @@ def translate(text, to_lang='zh'):
 
 
 @w.task
+@namespaced
 @concurrency(1)
 def update_users_location():
     locs = {}
@@ -360,10 +593,41 @@ def update_users_location():
             'timezone': location.get('timezone', 0)
         }
     users_stats = mongodb().users_stats
-    for user in users_stats.find({'info.location': {'$ne': None}}):
+    pipe = redis().pipeline()
+    for i, user in enumerate(users_stats.find({'info.location': {'$ne': None}},
+                                              {'info.location': 1, 'month': 1})):
         location = user['info']['location'].lower()
         if location in locs:
             users_stats.update({'_id': user['_id']}, {'$set': {'loc': locs[location]}})
+            if locs[location]['country']:
+                active.add_user_months(pipe, locs[location]['country'], user['_id'], user.get('month'))
+        i % 100 or pipe.execute()
+    pipe.execute()
+
+
+@w.task(ignore_result=True)
+def rollup_active_users(year=None):
+    '''merge monthly distinct active users counters into yearly ones.'''
+    year = year or datetime.now().year - 1
+    r = redis()
+    for lang in mongodb().languages.find({}, {'_id': 1}):
+        active.rollup(r, 'lang', lang['_id'], year)
+    for country in mongodb().country_stats.find({}, {'_id': 1}):
+        active.rollup(r, 'country', country['_id'], year)
+
+
+@w.task(ignore_result=True)
+@namespaced
+@concurrency(1)
+def trim_month_repo_ranks(size=MONTH_REPO_RANK_SIZE):
+    '''keep only the top repositories in the leaderboards of closed months.'''
+    r = redis()
+    current = datetime.now().strftime('%Y-%m')
+    pipe = r.pipeline()
+    for key in r.scan_iter(match=_format('month:*:repo'), count=1000):
+        if key.split(':')[-2] < current:
+            pipe.zremrangebyrank(key, 0, -size - 1)
+    pipe.execute()
 
 
 @w.task
@@ -375,30 +639,204 @@ def rank():
     key = 'month.%d.%2d' % (year, month)
     # get languages sorted by activity of last month in the world.
     langs = [lang['_id'] for lang in mongodb().languages.find().sort(key, -1).limit(25)]
-    user_rank.delay(langs)
+    (user_rank.si(langs) | publish_rank.si(langs))()
 
 
 @w.task
+@namespaced
 def user_rank(langs, country='China', months=24):
     now = datetime.now()
     year, month = now.year - int(math.ceil((months - now.month + 1) / 12.)), (now.month - months - 1) % 12 + 1
 
-    pipe = redis().pipeline()
+    r = redis()
+    pipe = r.pipeline()
     t_keys = {lang: _format('%s:%s' % (str(time.time()), lang)) for lang in langs}
-    for i, user in enumerate(mongodb().users_stats.find({'loc.country': country,
-                                                         'contrib': {'$ne': None},
-                                                         'robot': {'$ne': True}},
-                                                        {'contrib': 1, 'loc': 1})):
+
+    def flush(scores):
+        uids = dict(zip(scores, ids.ids(r, list(scores))))
+        for username, values in scores.items():
+            for lang, v in values:
+                pipe.zadd(t_keys[lang], uids[username], v)
+        pipe.execute()
+        scores.clear()
+
+    scores = {}
+    for user in mongodb().users_stats.find({'loc.country': country,
+                                            'contrib': {'$ne': None},
+                                            'robot': {'$ne': True}},
+                                           {'contrib': 1, 'loc': 1}):
+        values = []
         for lang in user.get('contrib', {}):
             if lang in langs:
                 c = user['contrib'][lang]
                 v = sum(c[y][m] for y in c for m in c[y] if (int(y) > year or (int(y) == year and int(m) >= month)))
-                pipe.zadd(t_keys[lang], user['_id'], v)
-        i % 100 or pipe.execute()
-    pipe.execute()
+                values.append((lang, v))
+        scores[user['_id']] = values
+        len(scores) < 100 or flush(scores)
+    flush(scores)
     for lang in langs:
         r_key = _format("country:{0}.lang:{1}:user".format(country, lang))
         try:
             pipe.delete(r_key).rename(t_keys[lang], r_key).execute()
         except:
             pass
+
+
+@w.task
+@namespaced
+@concurrency(1)
+def publish_rank(langs, countries=['China']):
+    '''pre-render ranking pages once the leaderboards are swapped.'''
+    from . import snapshot
+    count = snapshot.publish(langs, countries, redis(), mongodb())
+    logger.info("Published %d ranking snapshots." % count)
+
+
+@w.task(ignore_result=True, time_limit=3600 * 24)
+@namespaced
+@concurrency(1)
+def related(k=20):
+    '''precompute similar developers and related repositories.'''
+    from . import related as _related
+    users, repos = _related.build(mongodb(), k)
+    logger.info("Related lists of %d users and %d repositories built." % (users, repos))
+
+
+@w.task(ignore_result=True)
+@namespaced
+def ensure_indexes():
+    '''build the missing mongo indexes of the namespace.'''
+    from . import schema
+    logger.info("Indexes %s ensured." % ', '.join(schema.ensure(mongodb())))
+
+
+@w.task(ignore_result=True)
+@concurrency(1)
+def recompute(end=None):
+    '''replay the timeline into a shadow namespace, then switch to it.
+
+    The whole timeline is replayed, from TIMELINE_START up to end (year, month,
+    day, hour), by default now. Aggregates can not be split by hour, so
+    nothing is carried over from the active namespace.
+    '''
+    start = TIMELINE_START.timetuple()[:4]
+    end = tuple(end or datetime.now().timetuple()[:4])
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    base = default_namespace()
+    ns = {'prefix': '%s_%s' % (base['prefix'], stamp), 'db': '%s_%s' % (base['db'], stamp)}
+    # the TTL frees the lock if the callback of the replay is never applied.
+    if not redis().set(control_key('shadow'), json.dumps(ns), nx=True, ex=RECOMPUTE_TTL):
+        logger.error("A recompute is already running.")
+        return
+    try:
+        logger.info("Recomputing %s to %s into %s." % (start, end, ns))
+        ensure_indexes(ns=ns)
+        copy_static(namespace(), ns)
+        _replay(ns, start, end, stamp)
+    except:
+        redis().delete(control_key('shadow'))
+        raise
+
+
+def _replay(ns, start, end, batch):
+    hours = int((datetime(*end) - datetime(*start)).total_seconds() / 3600)
+    dispatch_hours.delay(start, hours, batch=batch, callback=finish_recompute.si(ns, end), ns=ns)
+
+
+def _missing_hours(ns, start, end):
+    '''hours of [start, end) some processor has not processed in the namespace.'''
+    since = datetime(*start)
+    hours = int((datetime(*end) - since).total_seconds() / 3600)
+    keys = [archive.hour_key(h.year, h.month, h.day, h.hour)
+            for h in (since + timedelta(hours=i) for i in range(hours))]
+    missing = []
+    with use_namespace(ns):
+        r = redis()
+        for i in range(0, len(keys), 1000):
+            pipe = r.pipeline()
+            for key in keys[i:i + 1000]:
+                for fn in processors:
+                    pipe.sismember(_format('function:%s' % fn.__name__), key)
+            done = iter(pipe.execute())
+            missing.extend(key for key in keys[i:i + 1000] if not all([next(done) for fn in processors]))
+    return missing
+
+
+def copy_static(src, dst):
+    '''copy the data not derived from the timeline into another namespace.'''
+    with use_namespace(src):
+        s = mongodb()
+    with use_namespace(dst):
+        d = mongodb()
+    for name in ['locations', 'translation']:
+        for doc in s[name].find():
+            d[name].save(doc)
+    fields = ['info', 'loc', 'robot']
+    for user in s.users_stats.find({'$or': [{f: {'$exists': True}} for f in fields]},
+                                   dict((f, 1) for f in fields)):
+        d.users_stats.update({'_id': user.pop('_id')}, {'$set': user}, True)
+    for repo in s.repositories.find({'info': {'$exists': True}}, {'info': 1}):
+        d.repositories.update({'_id': repo['_id']}, {'$set': {'info': repo['info']}}, True)
+
+
+@w.task(ignore_result=True, time_limit=3600 * 24)
+def finish_recompute(ns, end):
+    '''rank the shadow namespace, make it the active one and drop the old one.
+
+    Hours which arrived during the replay are replayed first. The shadow is
+    dropped instead of switched to if it misses an hour the active namespace
+    has, or if ranking it fails.
+    '''
+    switched = catching_up = False
+    try:
+        now = datetime.now()
+        if (now - datetime(*end)).total_seconds() > FETCH_BATCH_HOURS * 3600:
+            logger.info("Catching up on the hours since %s in %s." % (end, ns))
+            redis().expire(control_key('shadow'), RECOMPUTE_TTL)
+            _replay(ns, end, now.timetuple()[:4], now.strftime('%Y%m%d%H%M%S'))
+            catching_up = True
+            return
+        # hours missing from the archive itself are missing from both.
+        first = TIMELINE_START.timetuple()[:4]
+        missing = sorted(set(_missing_hours(ns, first, end)) - set(_missing_hours(namespace(), first, end)))
+        if missing:
+            logger.error("Not switching to %s, %d hours are missing (%s...)." % (ns, len(missing), missing[0]))
+            return
+        # the bare bodies, the concurrency guard would swallow their errors.
+        from . import snapshot
+        with use_namespace(ns):
+            _body(update_users_location)()
+            _body(country_rank)()
+            _body(city_rank)()
+            langs = snapshot.top_languages(mongodb(), 25)
+            _body(user_rank)(langs)
+            _body(publish_rank)(langs)
+        old = set_namespace(ns)
+        switched = True
+        logger.info("Switched from %s to %s." % (old, ns))
+        if old != ns:
+            gc_namespace.apply_async((old,), countdown=NAMESPACE_GC_DELAY)
+    finally:
+        if not catching_up:
+            redis().delete(control_key('shadow'))
+            switched or gc_namespace.apply_async((ns,), countdown=NAMESPACE_GC_DELAY)
+
+
+@w.task(ignore_result=True)
+def gc_namespace(ns):
+    '''delete the redis keys, mongo database and snapshots of an inactive namespace.'''
+    if ns == namespace() or ns == json.loads(redis().get(control_key('shadow')) or 'null'):
+        logger.error("Refusing to delete namespace %s in use." % ns)
+        return
+    r = redis()
+    pipe = r.pipeline()
+    control = control_key('')
+    for i, key in enumerate(k for k in r.scan_iter(match='%s:*' % ns['prefix'], count=1000)
+                            if not k.startswith(control)):
+        pipe.delete(key)
+        i % 1000 or pipe.execute()
+    pipe.execute()
+    mongodb().connection.drop_database(ns['db'])
+    import shutil
+    from . import snapshot
+    shutil.rmtree(snapshot.directory(ns), ignore_errors=True)
@@ -4,9 +4,12 @@
 from __future__ import absolute_import
 
 from celery import Celery
+from celery.signals import celeryd_after_setup, worker_process_init
 from celery.utils.log import get_task_logger
 
 from . import celeryconfig
+from . import db
+from .config import POOL_SIZE, POOL_SIZES
 
 logger = get_task_logger(__name__)
 
@@ -14,5 +17,19 @@ worker = Celery('ghdata.worker')
 # Optional configuration, see the application user guide.
 worker.config_from_object(celeryconfig)
 
+
+@celeryd_after_setup.connect
+def setup_pool_size(sender, instance, **kwargs):
+    '''size the connection pools by the queues the worker consumes.'''
+    queues = instance.app.amqp.queues
+    names = list(getattr(queues, 'consume_from', None) or queues)
+    db.configure(max([POOL_SIZES.get(q, POOL_SIZE) for q in names] or [POOL_SIZE]))
+
+
+@worker_process_init.connect
+def reset_connections(**kwargs):
+    db.reset()
+
+
 if __name__ == '__main__':
     worker.start()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Load test of the API against a synthetic dataset.
+
+    python loadtest.py seed --users 100000
+    python loadtest.py run --requests 20000 --concurrency 50 [--log access.log]
+    python loadtest.py clean
+
+Everything is kept in its own namespace (PREFIX=loadtest, MONGODB_DB=
+github_loadtest unless set), the app is driven in-process through WSGI and
+every redis command batch and mongo message is counted per request. The
+query plans of the hot queries are checked after the run.
+'''
+
+import os
+os.environ.setdefault('PREFIX', 'loadtest')
+os.environ.setdefault('MONGODB_DB', 'github_loadtest')
+os.environ.setdefault('SNAPSHOT_DIR', '/tmp/ghdata/loadtest')
+
+from gevent import monkey; monkey.patch_all()
+
+import re
+import sys
+import time
+import random
+import shutil
+import argparse
+import StringIO
+from collections import defaultdict
+from wsgiref.util import setup_testing_defaults
+
+import gevent
+from gevent.pool import Pool
+
+from ghdata.db import redis, mongodb, format_key as _format
+import ghdata.ids as ids
+import ghdata.schema as schema
+
+LANGS = ['JavaScript', 'Ruby', 'Java', 'Python', 'PHP', 'C', 'C++', 'Go', 'Objective-C', 'Shell',
+         'C#', 'CSS', 'Perl', 'Scala', 'Haskell', 'Clojure', 'Lua', 'R', 'Rust', 'Erlang']
+COUNTRIES = ['China', 'United States', 'Germany', 'Japan', 'India']
+EVENTS = ['PushEvent', 'IssuesEvent', 'PullRequestEvent', 'WatchEvent', 'CreateEvent', 'ForkEvent']
+log_re = re.compile(r'"GET (\S+) HTTP/[0-9.]+"')
+
+
+def _months(count=24):
+    now = time.localtime()
+    year, month = now.tm_year, now.tm_mon
+    for i in range(count):
+        yield year, month
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def seed(users, repos, seed_value=0):
+    '''fill the load test namespace with users, repositories and leaderboards.'''
+    rnd = random.Random(seed_value)
+    r = redis()
+    db = mongodb()
+    schema.ensure(db)
+    months = list(_months())
+    repo_names = ['owner%d/repo%d' % (i % (repos / 10 + 1), i) for i in range(repos)]
+    repo_langs = dict((name, rnd.choice(LANGS)) for name in repo_names)
+    pipe = r.pipeline()
+    batch = []
+    for i in range(users):
+        name = 'user%d' % i
+        country = rnd.choice(COUNTRIES) if rnd.random() < 0.6 else None
+        contrib, user_repos = defaultdict(lambda: defaultdict(dict)), []
+        for repo in rnd.sample(repo_names, min(len(repo_names), rnd.randint(1, 8))):
+            events = int(rnd.paretovariate(1.2) * 5)
+            user_repos.append({'repo': repo, 'events': events})
+            year, month = rnd.choice(months)
+            lang = repo_langs[repo]
+            c = contrib[lang]['%d' % year]
+            c['%02d' % month] = c.get('%02d' % month, 0) + events
+        batch.append({
+            '_id': name,
+            'info': {'login': name, 'location': country, 'followers': rnd.randint(0, 500)},
+            'loc': {'country': country, 'timezone': 0} if country else {},
+            'contrib': contrib,
+            'repos': user_repos,
+            'total': sum(repo['events'] for repo in user_repos)
+        })
+        if len(batch) == 1000 or i == users - 1:
+            uids = dict(zip([u['_id'] for u in batch], ids.ids(r, [u['_id'] for u in batch])))
+            for user in batch:
+                uid = uids[user['_id']]
+                pipe.zadd(_format("user"), uid, user['total'])
+                for lang, c in user['contrib'].items():
+                    score = sum(v for y in c for v in c[y].values())
+                    pipe.zadd(_format("lang:{0}:user".format(lang)), uid, score)
+                    if user['loc'].get('country'):
+                        key = "country:{0}.lang:{1}:user".format(user['loc']['country'], lang)
+                        pipe.zadd(_format(key), uid, score)
+            pipe.execute()
+            db.users_stats.insert(batch)
+            batch = []
+    for name in repo_names:
+        total = rnd.randint(1, 5000)
+        db.repositories.insert({'_id': name, 'total': total,
+                                'info': {'full_name': name, 'language': repo_langs[name]}})
+        pipe.zadd(_format("repo"), name, total)
+        pipe.zadd(_format("lang:{0}:repo".format(repo_langs[name])), name, total)
+    for country in COUNTRIES:
+        # translations are cached so /users/:id never calls out to the translator.
+        db.translation.update({'_id': country}, {'$set': {'zh': country}}, True)
+    for lang in LANGS:
+        # nested like the "month.<year>.<'%2d' month>" $inc of the ingestion.
+        month = defaultdict(dict)
+        for year, m in months:
+            month[str(year)]['%2d' % m] = rnd.randint(100, 10000)
+        db.languages.insert({'_id': lang, 'total': rnd.randint(1000, 100000), 'month': month})
+    for year, month in months:
+        pipe.hset(_format("month"), '%04d-%02d' % (year, month), rnd.randint(10 ** 5, 10 ** 6))
+        for evttype in EVENTS:
+            pipe.hset(_format("event:{0}:month".format(evttype)), '%04d-%02d' % (year, month),
+                      rnd.randint(10 ** 4, 10 ** 5))
+    for hour in range(24):
+        pipe.hset(_format("hour"), hour, rnd.randint(10 ** 4, 10 ** 5))
+    pipe.set(_format("total"), 10 ** 8)
+    pipe.execute()
+
+
+def clean():
+    r = redis()
+    keys = list(r.scan_iter(match=_format('*'), count=1000))
+    for i in range(0, len(keys), 1000):
+        r.delete(*keys[i:i + 1000])
+    mongodb().connection.drop_database(mongodb().name)
+    shutil.rmtree(os.environ['SNAPSHOT_DIR'], ignore_errors=True)
+
+
+def synthetic_mix(count, seed_value=0):
+    '''request paths shaped like the production traffic.'''
+    rnd = random.Random(seed_value)
+    users = mongodb().users_stats.count()
+    mix = [
+        (50, lambda: '/rank?country=%s&language=%s&page=%d' % (
+            rnd.choice(COUNTRIES), rnd.choice(LANGS[:10]), int(rnd.expovariate(0.5)))),
+        (30, lambda: '/users/user%d' % rnd.randint(0, max(users - 1, 0))),
+        (10, lambda: '/languages'),
+        (5, lambda: '/timeline?granularity=month&event=%s' % rnd.choice(EVENTS)),
+        (5, lambda: '/repos/rank?language=%s&page=%d' % (rnd.choice(LANGS), rnd.randint(0, 3)))
+    ]
+    total = sum(weight for weight, gen in mix)
+    for i in range(count):
+        pick = rnd.uniform(0, total)
+        for weight, gen in mix:
+            pick -= weight
+            if pick <= 0:
+                yield gen()
+                break
+
+
+def recorded_mix(fn, count):
+    '''request paths from an access log (or a file of paths), repeated as needed.'''
+    with open(fn) as f:
+        lines = f.readlines()
+    paths = [m.group(1) for m in (log_re.search(l) for l in lines) if m] or \
+            [l.strip() for l in lines if l.startswith('/')]
+    for i in range(count):
+        yield paths[i % len(paths)]
+
+
+# round-trips counted per greenlet.
+_trips = defaultdict(lambda: defaultdict(int))
+
+
+def _counting(kind, fn):
+    def wrapper(*args, **kwargs):
+        _trips[gevent.getcurrent()][kind] += 1
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def instrument():
+    '''count redis command batches and mongo messages.'''
+    import redis.connection
+    import pymongo.mongo_client
+    conn = redis.connection.Connection
+    conn.send_packed_command = _counting('redis', conn.send_packed_command)
+    client = pymongo.mongo_client.MongoClient
+    client._send_message = _counting('mongo', client._send_message)
+    client._send_message_with_response = _counting('mongo', client._send_message_with_response)
+
+
+def _request(app, path):
+    path, _, query = path.partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET',
+               'HTTP_ACCEPT_ENCODING': 'gzip', 'wsgi.input': StringIO.StringIO()}
+    setup_testing_defaults(environ)
+    status = []
+    _trips.pop(gevent.getcurrent(), None)
+    start = time.time()
+    body = app(environ, lambda s, headers, exc_info=None: status.append(s))
+    size = sum(len(chunk) for chunk in body)
+    elapsed = time.time() - start
+    trips = _trips.pop(gevent.getcurrent(), {})
+    return path, status[0], elapsed, size, trips.get('redis', 0), trips.get('mongo', 0)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def run(paths, concurrency):
+    instrument()
+    from app import app
+    pool = Pool(concurrency)
+    start = time.time()
+    results = pool.map(lambda p: _request(app, p), paths)
+    elapsed = time.time() - start
+    by_endpoint = defaultdict(list)
+    for result in results:
+        endpoint = '/' + result[0].split('/')[1]
+        by_endpoint[endpoint].append(result)
+    print('%-12s %8s %7s %9s %9s %7s %7s' % ('endpoint', 'requests', 'errors', 'p50 ms', 'p99 ms',
+                                            'redis', 'mongo'))
+    for endpoint, rs in sorted(by_endpoint.items()):
+        latencies = [r[2] * 1000 for r in rs]
+        print('%-12s %8d %7d %9.2f %9.2f %7.2f %7.2f' % (
+            endpoint, len(rs), len([r for r in rs if not r[1].startswith(('200', '304'))]),
+            _percentile(latencies, 0.5), _percentile(latencies, 0.99),
+            1.0 * sum(r[4] for r in rs) / len(rs), 1.0 * sum(r[5] for r in rs) / len(rs)))
+    print('%d requests in %.2fs, %.1f req/s with concurrency %d.' % (
+        len(results), elapsed, len(results) / elapsed, concurrency))
+    print('')
+    flagged = schema.report(schema.explain())
+    if flagged:
+        print('%d hot queries scan a whole collection.' % flagged)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load test of the github-timeline API.')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('seed', help='fill the load test namespace with synthetic data')
+    p.add_argument('--users', type=int, default=100000)
+    p.add_argument('--repos', type=int, default=20000)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('run', help='replay requests against the app')
+    p.add_argument('--requests', type=int, default=10000)
+    p.add_argument('--concurrency', type=int, default=50)
+    p.add_argument('--log', help='access log or file of paths to replay instead of the synthetic mix')
+    p.add_argument('--seed', type=int, default=0)
+    sub.add_parser('clean', help='drop the load test namespace')
+    args = parser.parse_args(argv)
+    if args.command == 'seed':
+        seed(args.users, args.repos, args.seed)
+    elif args.command == 'run':
+        if args.log:
+            paths = list(recorded_mix(args.log, args.requests))
+        else:
+            paths = list(synthetic_mix(args.requests, args.seed))
+        run(paths, args.concurrency)
+    else:
+        clean()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])